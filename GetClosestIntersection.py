@@ -6,6 +6,8 @@ for maya to register your plugin
 import maya.api.OpenMaya as om
 
 import GetClosestIntersection.context.closest_intersection_ctx as closest_intersection_ctx
+import GetClosestIntersection.commands.closest_intersection_batch_cmd as closest_intersection_batch_cmd
+import GetClosestIntersection.util.maya.meshlist as meshlist
 
 '''
 Force Maya to only consider and pass API version 2.0 (maya.api.OpenMaya*) objects
@@ -21,12 +23,25 @@ def initializePlugin(mobject: om.MObject):
     except Exception as e:
         om.MGlobal.displayError(f"Unable to register '{closest_intersection_ctx.ClosestIntersectionContextCommand.COMMAND_NAME}' command")
         raise(e)
+    try:
+        mplugin.registerCommand(closest_intersection_batch_cmd.ClosestIntersectionBatchCommand.COMMAND_NAME, closest_intersection_batch_cmd.ClosestIntersectionBatchCommand.creator, closest_intersection_batch_cmd.ClosestIntersectionBatchCommand.syntax_creator)
+    except Exception as e:
+        om.MGlobal.displayError(f"Unable to register '{closest_intersection_batch_cmd.ClosestIntersectionBatchCommand.COMMAND_NAME}' command")
+        raise(e)
+    # Cache the meshes in the scene rather than walking the DAG on every click
+    meshlist.add_scene_callbacks()
 
 
 def uninitializePlugin(mobject: om.MObject):
     mplugin = om.MFnPlugin(mobject)
+    meshlist.remove_scene_callbacks()
     try:
         mplugin.deregisterContextCommand(closest_intersection_ctx.ClosestIntersectionContextCommand.COMMAND_NAME)
     except Exception as e:
         om.MGlobal.displayError(f"Unable to deregister '{closest_intersection_ctx.ClosestIntersectionContextCommand.COMMAND_NAME}' command")
+        raise(e)
+    try:
+        mplugin.deregisterCommand(closest_intersection_batch_cmd.ClosestIntersectionBatchCommand.COMMAND_NAME)
+    except Exception as e:
+        om.MGlobal.displayError(f"Unable to deregister '{closest_intersection_batch_cmd.ClosestIntersectionBatchCommand.COMMAND_NAME}' command")
         raise(e)
\ No newline at end of file
@@ -0,0 +1,107 @@
+import maya.api.OpenMaya as om
+
+import GetClosestIntersection.core.batch_raycast as batch_raycast
+
+'''
+Force Maya to only consider and pass API version 2.0 (maya.api.OpenMaya*) objects
+'''
+def maya_useNewAPI():
+    return True
+
+
+class ClosestIntersectionBatchCommand(om.MPxCommand):
+    '''
+    Non-interactive counterpart to the ClosestIntersectionContext for scripted pipelines and headless mayapy sessions.
+    Rays are either given as world space origins and directions or as normalized screen coordinates plus a camera:
+
+        cmds.closestIntersectionBatch(origin=[(0, 10, 0), (5, 10, 0)], direction=[(0, -1, 0), (0, -1, 0)])
+        cmds.closestIntersectionBatch(screen=[(0.5, 0.5)], camera="persp")
+
+    The result is a flat double array with batch_raycast.RESULT_STRIDE values per ray, [x, y, z, distance, mesh_index].
+    The names the mesh indices refer to can be queried with the meshNames flag.
+
+    The acceleration structure is rebuilt once meshes get added, removed, renamed or hidden or another scene is opened.
+    Moving meshes is not detected, pass the rebuild flag after transforming meshes between calls
+    '''
+
+    COMMAND_NAME = "closestIntersectionBatch"
+
+    ORIGIN_FLAG = ("-o", "-origin")
+    DIRECTION_FLAG = ("-d", "-direction")
+    SCREEN_FLAG = ("-s", "-screen")
+    CAMERA_FLAG = ("-c", "-camera")
+    MAX_DISTANCE_FLAG = ("-md", "-maxDistance")
+    MESH_NAMES_FLAG = ("-mn", "-meshNames")
+    REBUILD_FLAG = ("-rb", "-rebuild")
+
+    # Shared across invocations so the acceleration structure gets reused between calls
+    raycaster = batch_raycast.BatchRaycaster()
+
+    def __init__(self):
+        super().__init__()
+
+    def isUndoable(self):
+        return False
+
+    def _get_multi_use_values(self, arg_db: om.MArgDatabase, flag: str, count: int) -> list[float]:
+        '''
+        Flatten all uses of a multi-use flag taking `count` doubles into a single list
+        '''
+        values = []
+        for i in range(arg_db.numberOfFlagUses(flag)):
+            arg_list = arg_db.getFlagArgumentList(flag, i)
+            for j in range(count):
+                values.append(arg_list.asDouble(j))
+        return values
+
+    def doIt(self, args: om.MArgList):
+        arg_db = om.MArgDatabase(self.syntax(), args)
+        cls = ClosestIntersectionBatchCommand
+
+        if arg_db.isFlagSet(cls.REBUILD_FLAG[0]):
+            cls.raycaster.update(force=True)
+
+        if arg_db.isFlagSet(cls.MESH_NAMES_FLAG[0]):
+            cls.raycaster.update()
+            self.setResult(cls.raycaster.mesh_names)
+            return
+
+        max_distance = None
+        if arg_db.isFlagSet(cls.MAX_DISTANCE_FLAG[0]):
+            max_distance = arg_db.flagArgumentDouble(cls.MAX_DISTANCE_FLAG[0], 0)
+
+        if arg_db.isFlagSet(cls.SCREEN_FLAG[0]):
+            if not arg_db.isFlagSet(cls.CAMERA_FLAG[0]):
+                om.MGlobal.displayError(f"{cls.COMMAND_NAME} requires a camera when casting from screen coordinates")
+                return
+            camera = arg_db.flagArgumentString(cls.CAMERA_FLAG[0], 0)
+            screen_coords = self._get_multi_use_values(arg_db, cls.SCREEN_FLAG[0], 2)
+            result = cls.raycaster.raycast_from_camera(camera, screen_coords, max_distance)
+        elif arg_db.isFlagSet(cls.ORIGIN_FLAG[0]):
+            origins = self._get_multi_use_values(arg_db, cls.ORIGIN_FLAG[0], 3)
+            directions = self._get_multi_use_values(arg_db, cls.DIRECTION_FLAG[0], 3)
+            result = cls.raycaster.raycast(origins, directions, max_distance)
+        else:
+            # Only rebuilding the cache is a valid invocation as well
+            return
+
+        self.setResult(result)
+
+    @classmethod
+    def creator(cls):
+        return ClosestIntersectionBatchCommand()
+
+    @classmethod
+    def syntax_creator(cls):
+        syntax = om.MSyntax()
+        syntax.addFlag(*cls.ORIGIN_FLAG, om.MSyntax.kDouble, om.MSyntax.kDouble, om.MSyntax.kDouble)
+        syntax.makeFlagMultiUse(cls.ORIGIN_FLAG[0])
+        syntax.addFlag(*cls.DIRECTION_FLAG, om.MSyntax.kDouble, om.MSyntax.kDouble, om.MSyntax.kDouble)
+        syntax.makeFlagMultiUse(cls.DIRECTION_FLAG[0])
+        syntax.addFlag(*cls.SCREEN_FLAG, om.MSyntax.kDouble, om.MSyntax.kDouble)
+        syntax.makeFlagMultiUse(cls.SCREEN_FLAG[0])
+        syntax.addFlag(*cls.CAMERA_FLAG, om.MSyntax.kString)
+        syntax.addFlag(*cls.MAX_DISTANCE_FLAG, om.MSyntax.kDouble)
+        syntax.addFlag(*cls.MESH_NAMES_FLAG)
+        syntax.addFlag(*cls.REBUILD_FLAG)
+        return syntax
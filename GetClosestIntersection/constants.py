@@ -4,5 +4,17 @@ DEBUG = False
 # Enable/Disable additional logging to give further insights on the process
 VERBOSE_LOGGING = False
 
-# Specify the acceleration structure, valid options are "None", "Octree", or "BVH"
-ACCELERATION_STRUCTURE = "BVH"
\ No newline at end of file
+# Specify the acceleration structure, valid options are "None", "Octree", "BVH" or "Grid"
+ACCELERATION_STRUCTURE = "BVH"
+
+# Build the top levels of the BVH from the transform hierarchy (e.g. car -> wheel -> bolts) rather than purely by median splits
+BVH_SEED_FROM_HIERARCHY = False
+
+# Cull everything outside of the active camera's frustum before casting rays, the visible set is cached until the camera or scene changes
+FRUSTUM_CULLING = True
+
+# Restrict picking to a subset of the scene, valid options are "All" or "Selection" (the selected meshes and everything parented underneath the selection)
+QUERY_SCOPE = "All"
+
+# Maximum amount of dedicated acceleration structures kept for frequently used query filters before the least recently used one is evicted
+FILTER_CACHE_SIZE = 8
\ No newline at end of file
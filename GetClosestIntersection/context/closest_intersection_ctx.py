@@ -1,13 +1,14 @@
 import maya.api.OpenMaya as om
 import maya.api.OpenMayaUI as omui
-import maya.cmds as cmds
 
 import GetClosestIntersection.core.project_to_3d as project_to_3d
+import GetClosestIntersection.core.frustum as frustum
 import GetClosestIntersection.core.acceleration_structures as acceleration_structures
 
 import GetClosestIntersection.constants as constants
 
 import GetClosestIntersection.util.maya.meshlist as meshlist
+import GetClosestIntersection.util.maya.mesh_filter as mesh_filter
 import GetClosestIntersection.util.maya.locator as locator
 import GetClosestIntersection.util.timer as timer
 
@@ -27,54 +28,170 @@ class ClosestIntersectionContext(omui.MPxContext):
         super().__init__()
         self.setTitleString(ClosestIntersectionContext.TITLE)
 
+        # The frustum the acceleration structure was last culled against, None if it is not culled
+        self._frustum = None
+
+        # Filter mask of the current selection, None if it needs to be recomputed on the next press
+        self._selection_mask = None
+        self._selection_callback_ids = []
+
+        # Groups whose transform changed since the last press, only tracked for BVHs seeded from the hierarchy
+        self._moved_groups = set()
+        self._transform_callback_ids = []
+        self._tool_active = False
+
         # Initialize the acceleration structures and get the mesh list
+        self._scene_generation = meshlist.get_scene_generation()
         try:
-            self.meshlist = meshlist.MFnMeshList(self.get_meshes_in_scene())
+            self.meshlist = meshlist.MFnMeshList.from_scene()
         except:
             return
 
-        if constants.ACCELERATION_STRUCTURE == "BVH":
-            self.accel_structure = acceleration_structures.BVH(self.meshlist, self.meshlist.bbox)
-        elif constants.ACCELERATION_STRUCTURE == "Octree":
-            self.accel_structure = acceleration_structures.Octree(self.meshlist, self.meshlist.bbox)
-        elif constants.ACCELERATION_STRUCTURE == "None":
-            self.accel_structure = acceleration_structures.BruteForce()
-        else:
-            om.MGlobal.displayError("Invalid choice of Acceleration structure, valid options are: {'None', 'Octree', 'BVH'} ")
+        self.build_acceleration_structure()
+
+    def build_acceleration_structure(self):
+        '''
+        (Re-)build the acceleration structure specified in constants.py over the current meshlist
+        '''
+        self._frustum = None
+        self._selection_mask = None
+        self._moved_groups.clear()
+        self.accel_structure = acceleration_structures.create_acceleration_structure(self.meshlist)
+        if self._tool_active:
+            self._watch_group_transforms()
+
+    def _invalidate_selection_mask(self, *args):
+        self._selection_mask = None
+
+    def _on_transform_moved(self, transform: om.MObject, modified, group: str):
+        self._moved_groups.add(group)
+
+    def _tracks_groups(self) -> bool:
+        return isinstance(self.accel_structure, acceleration_structures.BVH) and self.accel_structure.seed_from_hierarchy
+
+    def _watch_group_transforms(self):
+        '''
+        Track the transforms of all groups and meshes of a BVH seeded from the hierarchy, such that a moved group only
+        rebuilds its own subtree on the next press. A mesh moving on its own marks the group directly holding it
+        '''
+        om.MMessage.removeCallbacks(self._transform_callback_ids)
+        self._transform_callback_ids = []
+        if not self._tracks_groups():
+            return
+
+        selection_list = om.MSelectionList()
+        groups = self.accel_structure.get_groups()
+        for group in groups:
+            selection_list.add(group)
+        for index, group in enumerate(groups):
+            self._transform_callback_ids.append(
+                om.MDagMessage.addWorldMatrixModifiedCallback(selection_list.getDagPath(index), self._on_transform_moved, group))
+
+        for index, dag_path in enumerate(self.meshlist.mfn_dagpaths):
+            transform = om.MDagPath(dag_path)
+            transform.pop()
+            self._transform_callback_ids.append(om.MDagMessage.addWorldMatrixModifiedCallback(
+                transform, self._on_transform_moved, self.accel_structure.get_group_at_index(index)))
+
+    def toolOnSetup(self, event):
+        # Only recompute the selection filter once the selection or the hierarchy below it changed rather than on every press
+        self._selection_callback_ids = [
+            om.MEventMessage.addEventCallback("SelectionChanged", self._invalidate_selection_mask),
+            om.MDagMessage.addAllDagChangesCallback(self._invalidate_selection_mask),
+        ]
+        self._selection_mask = None
+
+        if not hasattr(self, "accel_structure"):
+            return
+        # Moves while the tool was inactive went unnoticed, treat every group as moved
+        if self._transform_callback_ids is None:
+            self._transform_callback_ids = []
+            if self._tracks_groups():
+                self._moved_groups.add("")
+        self._tool_active = True
+        self._watch_group_transforms()
+
+    def toolOffCleanup(self):
+        om.MMessage.removeCallbacks(self._selection_callback_ids)
+        self._selection_callback_ids = []
+        om.MMessage.removeCallbacks(self._transform_callback_ids)
+        self._transform_callback_ids = None
+        self._tool_active = False
 
     def get_meshes_in_scene(self) -> list:
         '''
-        Return all mesh instances in a scene
+        Return all visible, non-intermediate mesh instances in a scene
         '''
-        return cmds.ls(type="mesh")
+        return meshlist.get_scene_mesh_names()
     
     def check_meshes_is_stale(self):
         '''
-        Checks if our list of mfn_meshes is stale and if so, recompute it.
+        Checks if our list of mfn_meshes is stale, i.e. the meshes changed or another scene was opened, and if so, recompute it.
 
-        This does not check for animation! If your meshes move, please implement a function to check for it.
+        This does not check for animation! Moved meshes are only picked up by check_groups_are_stale() for a BVH seeded
+        from the hierarchy, otherwise please implement a function to check for it.
         '''
         scene_meshes = self.get_meshes_in_scene()
-        if not self.meshlist == scene_meshes:
+        generation = meshlist.get_scene_generation()
+        if generation != self._scene_generation or not self.meshlist == scene_meshes:
             timer.ScopedTimer("Recalculating the MeshList and Acceleration Structure")
-            self.meshlist = meshlist.MFnMeshList(scene_meshes)
-            if constants.ACCELERATION_STRUCTURE == "BVH":
-                self.accel_structure = acceleration_structures.BVH(self.meshlist, self.meshlist.bbox)
-            elif constants.ACCELERATION_STRUCTURE == "Octree":
-                self.accel_structure = acceleration_structures.Octree(self.meshlist, self.meshlist.bbox)
-            elif constants.ACCELERATION_STRUCTURE == "None":
-                self.accel_structure = acceleration_structures.BruteForce()
+            self._scene_generation = generation
+            self.meshlist = meshlist.MFnMeshList.from_scene()
+            self.build_acceleration_structure()
+
+    def check_groups_are_stale(self):
+        '''
+        Rebuild the subtrees of the groups whose transform changed since the last press. Nested moved groups are covered
+        by rebuilding the outermost moved group above them
+        '''
+        if not self._moved_groups:
+            return
+        for group in self._moved_groups:
+            ancestor = group
+            while ancestor:
+                ancestor = ancestor.rpartition("|")[0]
+                if ancestor in self._moved_groups:
+                    break
             else:
-                om.MGlobal.displayError("Invalid choice of Acceleration structure, valid options are: {'None', 'Octree', 'BVH'} ")
+                if group or len(self.meshlist):
+                    self.accel_structure.rebuild_group(group)
+        self._moved_groups.clear()
+
+    def check_frustum_is_stale(self):
+        '''
+        Checks if the frustum of the active view changed since the acceleration structure was last culled and if so,
+        re-cull it. Repeated clicks from the same camera reuse the cached visible set
+        '''
+        if not constants.FRUSTUM_CULLING:
+            return
+        view_frustum = frustum.Frustum.from_view(omui.M3dView.active3dView())
+        if view_frustum != self._frustum:
+            self.accel_structure.cull(self.meshlist, view_frustum)
+            self._frustum = view_frustum
+
+    def get_filter_mask(self) -> int:
+        '''
+        Get the filter mask for the QUERY_SCOPE specified in constants.py, None if all meshes should be considered
+        '''
+        if constants.QUERY_SCOPE == "Selection":
+            if self._selection_mask is None or not self._selection_callback_ids:
+                self._selection_mask = mesh_filter.selection_mask(self.meshlist)
+            # Fall back to the whole scene if nothing relevant is selected
+            return self._selection_mask or None
+        elif constants.QUERY_SCOPE != "All":
+            om.MGlobal.displayError("Invalid choice of query scope, valid options are: {'All', 'Selection'} ")
+        return None
 
     def doPress(self, event, draw_manager, frame_context):
         screen_space_pos = event.position
         ray = project_to_3d.project_to_3d(screen_space_pos)
 
         self.check_meshes_is_stale()
+        self.check_groups_are_stale()
+        self.check_frustum_is_stale()
 
         # Find the closest intersection for the mesh list using a BVH but can be modified to use an octree or brute-force
-        result = self.accel_structure.get_closest_intersection(self.meshlist, ray)
+        result = self.accel_structure.get_closest_intersection(self.meshlist, ray, self.get_filter_mask())
         if result:
             if constants.DEBUG:
                 locator.Locator("Intersection_Point_1", result[1])
@@ -1,3 +1,5 @@
 from .bruteforce import BruteForce
 from .bvh import BVH
-from .octree import Octree
\ No newline at end of file
+from .grid import Grid
+from .octree import Octree
+from .factory import create_acceleration_structure
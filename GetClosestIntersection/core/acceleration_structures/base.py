@@ -1,6 +1,9 @@
 from abc import ABC, abstractmethod
 
+import maya.api.OpenMaya as om
+
 import GetClosestIntersection.core.ray as ray
+import GetClosestIntersection.core.frustum as frustum
 import GetClosestIntersection.util.maya.meshlist as meshlist
 
 class AccelerationStructure(ABC):
@@ -14,5 +17,65 @@ class AccelerationStructure(ABC):
         pass
     
     @abstractmethod
-    def get_closest_intersection(self, meshes: meshlist.MFnMeshList, ray:ray.Ray) -> None:
-        pass
\ No newline at end of file
+    def cull(self, meshes: meshlist.MFnMeshList, view_frustum: frustum.Frustum) -> None:
+        pass
+
+    @abstractmethod
+    def get_closest_intersection(self, meshes: meshlist.MFnMeshList, ray:ray.Ray, mask: int = None) -> None:
+        pass
+
+    @abstractmethod
+    def closest_hit(self, meshes: meshlist.MFnMeshList, ray: ray.Ray, max_distance: float = None, mask: int = None, use_cull: bool = False) -> None:
+        pass
+
+    @abstractmethod
+    def any_hit(self, meshes: meshlist.MFnMeshList, ray: ray.Ray, max_distance: float = None, mask: int = None, use_cull: bool = False) -> None:
+        pass
+
+    @abstractmethod
+    def all_hits(self, meshes: meshlist.MFnMeshList, ray: ray.Ray, max_distance: float = None, limit: int = None, mask: int = None, use_cull: bool = False) -> None:
+        pass
+
+    def _get_max_param(self, ray: ray.Ray, max_distance: float = None) -> float:
+        '''
+        Get the maxParam to pass to the MFnMesh intersection functions for a given maximum distance along the ray
+        '''
+        if max_distance is None:
+            return 9999999
+        return ray.param_at_distance(max_distance)
+
+    def _closest_hit_among(self, meshes: meshlist.MFnMeshList, ray: ray.Ray, indices, max_distance: float = None):
+        '''
+        Find the closest hit among the given meshlist indices. The meshes are tested ordered by the ray parameter at which
+        their bounding box is entered, stopping once the next bounding box starts beyond the closest confirmed hit
+
+        :return: A tuple of (mesh name, hit position, distance) or None
+        '''
+        best_param = self._get_max_param(ray, max_distance)
+        candidates = []
+        for index in indices:
+            bbox_range = ray.intersect_bbox_range(meshes.get_bbox_at_index(index))
+            if bbox_range and bbox_range[0] <= best_param:
+                candidates.append((bbox_range[0], index))
+        candidates.sort()
+
+        # Convert to MFloatPoint ahead of time to avoid doing it for every mesh iteration
+        ray_origin = om.MFloatPoint(ray.origin)
+        ray_direction = om.MFloatVector(ray.direction)
+        best_hit = None
+        for t_enter, index in candidates:
+            if t_enter > best_param:
+                break
+            intersection_point = meshes.mfn_meshes[index].closestIntersection(ray_origin,              # raySource
+                                                                              ray_direction,           # rayDirection
+                                                                              om.MSpace.kWorld,        # space
+                                                                              best_param,              # maxParam
+                                                                              False)                   # testBothDirections
+            if intersection_point and intersection_point[1] <= best_param:
+                best_param = intersection_point[1]
+                best_hit = (index, intersection_point[0])
+
+        if best_hit is None:
+            return None
+        index, point = best_hit
+        return (meshes.get_name_at_index(index), point, ray_origin.distanceTo(point))
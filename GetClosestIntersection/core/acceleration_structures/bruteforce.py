@@ -2,24 +2,39 @@ import maya.api.OpenMaya as om
 
 from GetClosestIntersection.core.acceleration_structures.base import AccelerationStructure
 import GetClosestIntersection.core.ray as ray
+import GetClosestIntersection.core.frustum as frustum
 
 import GetClosestIntersection.util.maya.meshlist as meshlist
+import GetClosestIntersection.util.maya.mesh_filter as mesh_filter
 import GetClosestIntersection.util.timer as timer
 
 class BruteForce(AccelerationStructure):
     
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
+        self._visible_indices = None
 
     def find_intersections(self, *args, **kwargs) -> None:
         raise NotImplementedError("BruteForce has no method for intersecting bounding boxes")
 
     @timer.timer_decorator
-    def get_closest_intersection(self, meshes: meshlist.MFnMeshList, ray: ray.Ray):
+    def cull(self, meshes: meshlist.MFnMeshList, view_frustum: frustum.Frustum):
+        '''
+        Restrict get_closest_intersection and the queries passed use_cull to the meshes whose bounding box is visible
+        in the given frustum. Passing None resets the queries to all meshes
+        '''
+        if view_frustum is None:
+            self._visible_indices = None
+            return
+        self._visible_indices = [i for i in range(len(meshes)) if view_frustum.classify_bbox(meshes.get_bbox_at_index(i)) != frustum.OUTSIDE]
+
+    @timer.timer_decorator
+    def get_closest_intersection(self, meshes: meshlist.MFnMeshList, ray: ray.Ray, mask: int = None):
         '''
         Brute-force approach of getting the mesh intersection point for a given ray by iterating all the meshes
 
         :param meshes: the meshlist of the whole scene to iterate over
+        :param mask: optional filter bitmask over the meshlist indices, see util.maya.mesh_filter
 
         :return: The mesh name the intersection was found for and the hit position or None
         '''
@@ -32,7 +47,11 @@ class BruteForce(AccelerationStructure):
         distances_list = []
         max_param = 9999999
 
-        for i, mesh in enumerate(meshes.mfn_meshes):
+        indices = self._visible_indices if self._visible_indices is not None else range(len(meshes))
+        if mask is not None:
+            indices = [index for index in indices if mesh_filter.is_eligible(mask, index)]
+        for i, index in enumerate(indices):
+            mesh = meshes.mfn_meshes[index]
             intersection_point = mesh.closestIntersection(ray_origin,                           # raySource
                                                           ray_direction,                        # rayDirection
                                                           om.MSpace.kWorld,                     # space
@@ -56,5 +75,94 @@ class BruteForce(AccelerationStructure):
             om.MGlobal.displayWarning(f"No intersection found for ray [{ray}]")
             return None
         else:
-            return (meshes.get_name_at_index(min_index), intersection_list[min_index][0])
+            return (meshes.get_name_at_index(indices[min_index]), intersection_list[min_index][0])
+
+    @timer.timer_decorator
+    def closest_hit(self, meshes: meshlist.MFnMeshList, ray: ray.Ray, max_distance: float = None, mask: int = None, use_cull: bool = False):
+        '''
+        Brute-force approach of getting the closest hit within max_distance without any warning on a miss, the meshes
+        are tested ordered by their bounding box to stop early
+
+        :param meshes: the meshlist of the whole scene to iterate over
+        :param max_distance: the maximum distance along the ray to consider, unlimited if None
+        :param mask: optional filter bitmask over the meshlist indices, see util.maya.mesh_filter
+        :param use_cull: only consider what is visible in the frustum passed to cull(). Off by default such that e.g.
+                         occlusion checks are not affected by the last camera the structure was culled against
+
+        :return: A tuple of (mesh name, hit position, distance) or None
+        '''
+        indices = self._visible_indices if use_cull and self._visible_indices is not None else range(len(meshes))
+        if mask is not None:
+            indices = [index for index in indices if mesh_filter.is_eligible(mask, index)]
+        return self._closest_hit_among(meshes, ray, indices, max_distance)
+
+    @timer.timer_decorator
+    def any_hit(self, meshes: meshlist.MFnMeshList, ray: ray.Ray, max_distance: float = None, mask: int = None, use_cull: bool = False):
+        '''
+        Brute-force approach of checking whether the ray hits any mesh within max_distance, returning as soon as the
+        first hit is found
+
+        :param meshes: the meshlist of the whole scene to iterate over
+        :param max_distance: the maximum distance along the ray to consider, unlimited if None
+        :param mask: optional filter bitmask over the meshlist indices, see util.maya.mesh_filter
+        :param use_cull: only consider what is visible in the frustum passed to cull(). Off by default such that e.g.
+                         occlusion checks are not affected by the last camera the structure was culled against
+
+        :return: The mesh name of the first found hit and the hit position or None
+        '''
+        # Convert to MFloatPoint ahead of time to avoid doing it for every mesh iteration
+        ray_origin = om.MFloatPoint(ray.origin)
+        ray_direction = om.MFloatVector(ray.direction)
+        max_param = self._get_max_param(ray, max_distance)
+
+        indices = self._visible_indices if use_cull and self._visible_indices is not None else range(len(meshes))
+        if mask is not None:
+            indices = [index for index in indices if mesh_filter.is_eligible(mask, index)]
+        for index in indices:
+            mesh = meshes.mfn_meshes[index]
+            intersection_point = mesh.anyIntersection(ray_origin,                           # raySource
+                                                      ray_direction,                        # rayDirection
+                                                      om.MSpace.kWorld,                     # space
+                                                      max_param,                            # maxParam
+                                                      False)                                # testBothDirections
+            if intersection_point:
+                return (meshes.get_name_at_index(index), intersection_point[0])
+        return None
+
+    @timer.timer_decorator
+    def all_hits(self, meshes: meshlist.MFnMeshList, ray: ray.Ray, max_distance: float = None, limit: int = None, mask: int = None, use_cull: bool = False):
+        '''
+        Brute-force approach of getting the closest hit of every mesh the ray passes through within max_distance
+
+        :param meshes: the meshlist of the whole scene to iterate over
+        :param max_distance: the maximum distance along the ray to consider, unlimited if None
+        :param limit: the maximum amount of hits to return, all hits if None
+        :param mask: optional filter bitmask over the meshlist indices, see util.maya.mesh_filter
+        :param use_cull: only consider what is visible in the frustum passed to cull(). Off by default such that e.g.
+                         occlusion checks are not affected by the last camera the structure was culled against
+
+        :return: A list of (mesh name, hit position, distance) tuples sorted by distance
+        '''
+        # Convert to MFloatPoint ahead of time to avoid doing it for every mesh iteration
+        ray_origin = om.MFloatPoint(ray.origin)
+        ray_direction = om.MFloatVector(ray.direction)
+        max_param = self._get_max_param(ray, max_distance)
+
+        hits = []
+        indices = self._visible_indices if use_cull and self._visible_indices is not None else range(len(meshes))
+        if mask is not None:
+            indices = [index for index in indices if mesh_filter.is_eligible(mask, index)]
+        for index in indices:
+            mesh = meshes.mfn_meshes[index]
+            intersection_point = mesh.closestIntersection(ray_origin,                           # raySource
+                                                          ray_direction,                        # rayDirection
+                                                          om.MSpace.kWorld,                     # space
+                                                          max_param,                            # maxParam
+                                                          False)                                # testBothDirections
+            if intersection_point:
+                hits.append((meshes.get_name_at_index(index), intersection_point[0], ray_origin.distanceTo(intersection_point[0])))
 
+        hits.sort(key=lambda hit: hit[2])
+        if limit is not None:
+            return hits[:limit]
+        return hits
@@ -1,14 +1,21 @@
+import heapq
+import itertools
+import time
+
 import maya.api.OpenMaya as om
 
 import GetClosestIntersection.constants as constants
 
 from GetClosestIntersection.core.acceleration_structures.base import AccelerationStructure
 import GetClosestIntersection.core.ray as ray
+import GetClosestIntersection.core.frustum as frustum
 
 import GetClosestIntersection.util.maya.meshlist as meshlist
+import GetClosestIntersection.util.maya.mesh_filter as mesh_filter
 import GetClosestIntersection.util.timer as timer
 import GetClosestIntersection.util.priority_set as priority_set
 import GetClosestIntersection.util.debug as debug
+import GetClosestIntersection.util.lru_cache as lru_cache
 
 class BVHNode:
     def __init__(self, bbox, indices = None, left = None, right = None):
@@ -16,20 +23,63 @@ class BVHNode:
         self.indices: list[int] = indices
         self.left: BVHNode = left
         self.right: BVHNode = right
+        self.parent: BVHNode = None
+        for child in (left, right):
+            if child:
+                child.parent = self
 
 class BVH(AccelerationStructure):
+
+    # Relative costs of traversing a node and intersecting a mesh used for the SAH cost. Intersections are weighted much
+    # heavier as MFnMesh.closestIntersection() dominates the query time
+    TRAVERSAL_COST = 1.0
+    INTERSECTION_COST = 10.0
+
+    # A filter has to be queried this many times before a dedicated sub-BVH gets built for it
+    FILTER_BUILD_THRESHOLD = 2
+
+    # When seeding from the hierarchy, a group whose children's summed volume exceeds its own volume by this factor is
+    # considered badly bounded and gets split by median instead
+    HIERARCHY_OVERLAP_THRESHOLD = 2.0
     
     @timer.timer_decorator
-    def __init__(self, meshlist: meshlist.MFnMeshList, bbox: om.MBoundingBox, max_depth = 32, sample_count = 32):
+    def __init__(self, meshlist: meshlist.MFnMeshList, bbox: om.MBoundingBox, max_depth = 32, sample_count = 32, indices: list[int] = None,
+                 seed_from_hierarchy = False):
+        '''
+        :param indices: the meshlist indices to build the tree over, defaults to all meshes
+        :param seed_from_hierarchy: build the top levels of the tree from the Maya transform hierarchy rather than
+                                    purely by median splits, see _build_hierarchy()
+        '''
         if max_depth < 1:
             om.MGlobal.displayError(f"{self.__init__.__qualname__} max_depth parameter must be greater than 0")
         if sample_count < 1:
             om.MGlobal.displayError(f"{self.__init__.__qualname__} sample_count parameter must be greater than 0")
         self.meshlist = meshlist
+        self.seed_from_hierarchy = seed_from_hierarchy
         self._sample_count = sample_count
         self._max_depth = max_depth
         self._depth = 0
-        self.root = self._recursive_build(meshlist, list(range(len(meshlist.mfn_meshes))), bbox, max_depth)
+        if indices is None:
+            indices = list(range(len(meshlist.mfn_meshes)))
+
+        # Maps a group's full dag path to the node of its subtree, only filled when seeding from the hierarchy
+        self._group_nodes: dict[str, BVHNode] = {}
+        self._group_depths: dict[str, int] = {}
+        self._group_children: dict[str, set[str]] = {}
+        self._group_meshes: dict[str, list[int]] = {}
+        if seed_from_hierarchy:
+            self.root = self._build_hierarchy(meshlist, indices, max_depth)
+        else:
+            self.root = self._recursive_build(meshlist, indices, bbox, max_depth)
+        self._roots = [self.root]
+        self._frustum = None
+
+        # Nodes containing at least one eligible mesh per recently used filter, keyed by their mask
+        self._eligible_nodes = lru_cache.LRUCache(constants.FILTER_CACHE_SIZE)
+
+        # Dedicated sub-BVHs for frequently used filters, keyed by their mask
+        self._filter_uses = lru_cache.LRUCache(64)
+        self._filtered_bvhs = lru_cache.LRUCache(constants.FILTER_CACHE_SIZE)
 
     def _find_longest_axis(self, bbox: om.MBoundingBox) -> int:
         '''
@@ -83,6 +133,206 @@ class BVH(AccelerationStructure):
 
         return BVHNode(bbox, left=left_node, right=right_node)
 
+    def _bbox_of_indices(self, indices: list[int]) -> om.MBoundingBox:
+        bbox = om.MBoundingBox()
+        for index in indices:
+            bbox.expand(self.meshlist.get_bbox_at_index(index))
+        return bbox
+
+    def _build_hierarchy(self, meshlist: meshlist.MFnMeshList, indices: list[int], max_depth: int) -> BVHNode:
+        '''
+        Build the tree seeded from the Maya transform hierarchy. Every group (a transform above a mesh's own transform)
+        becomes a subtree, such that assemblies like car -> wheel -> bolts stay together and can later be rebuilt on
+        their own using rebuild_group()
+        '''
+        for index in indices:
+            group = self.get_group_at_index(index)
+            self._group_meshes.setdefault(group, []).append(index)
+
+            # Register the chain of groups up to the world, stopping once we hit an already registered group
+            child = group
+            while child:
+                parent = child.rpartition("|")[0]
+                siblings = self._group_children.setdefault(parent, set())
+                if child in siblings:
+                    break
+                siblings.add(child)
+                child = parent
+
+        return self._build_group("", max_depth)
+
+    def _get_group_indices(self, group: str) -> list[int]:
+        '''
+        Get the meshlist indices of all meshes within a group, including those of nested groups
+        '''
+        indices = list(self._group_meshes.get(group, []))
+        for child in self._group_children.get(group, ()):
+            indices.extend(self._get_group_indices(child))
+        return indices
+
+    def _build_group(self, group: str, depth: int) -> BVHNode:
+        '''
+        Recursively build the subtree of a group by combining the subtrees of its child groups with a median split
+        subtree of the meshes directly within it. Falls back to a median split over all meshes of the group once the
+        depth budget is used up or the group is badly bounded, the nested groups then do not get a subtree of their own
+
+        :return: The root node of the group's subtree or None if the group does not contain any meshes
+        '''
+        if depth <= 1 or self._is_badly_bounded(group):
+            # Drop the subtrees of nested groups from a previous build, they are not part of the tree anymore
+            self._forget_nested_groups(group)
+            indices = self._get_group_indices(group)
+            node = self._recursive_build(self.meshlist, indices, self._bbox_of_indices(indices), depth) if indices else None
+        else:
+            entries = []
+            for child in sorted(self._group_children.get(group, ())):
+                child_node = self._build_group(child, depth - 1)
+                if child_node:
+                    entries.append(child_node)
+            direct_indices = self._group_meshes.get(group, [])
+            if direct_indices:
+                entries.append(self._recursive_build(self.meshlist, direct_indices, self._bbox_of_indices(direct_indices), depth - 1))
+
+            if not entries:
+                node = None
+            elif len(entries) == 1:
+                # Collapse groups holding a single child rather than adding a level to the tree
+                node = entries[0]
+            else:
+                bbox = om.MBoundingBox()
+                for entry in entries:
+                    bbox.expand(entry.bbox)
+                node = self._combine_entries(entries, bbox)
+
+        if node and group:
+            self._group_nodes[group] = node
+            self._group_depths[group] = depth
+        return node
+
+    def _is_badly_bounded(self, group: str) -> bool:
+        '''
+        Check whether the children of a group (its nested groups and the meshes directly within it) overlap so much that
+        splitting the group along the hierarchy would be worse than a median split. Checked before recursing into the
+        children such that no subtrees get built only to be thrown away
+        '''
+        entry_bboxes = [self._bbox_of_indices(self._get_group_indices(child)) for child in self._group_children.get(group, ())]
+        direct_indices = self._group_meshes.get(group, [])
+        if direct_indices:
+            entry_bboxes.append(self._bbox_of_indices(direct_indices))
+        if len(entry_bboxes) < 2:
+            return False
+
+        bbox = om.MBoundingBox()
+        for entry_bbox in entry_bboxes:
+            bbox.expand(entry_bbox)
+        volume = bbox.width * bbox.height * bbox.depth
+        if volume == 0:
+            return False
+        entries_volume = sum(entry_bbox.width * entry_bbox.height * entry_bbox.depth for entry_bbox in entry_bboxes)
+        return entries_volume / volume > BVH.HIERARCHY_OVERLAP_THRESHOLD
+
+    def _forget_nested_groups(self, group: str):
+        for child in self._group_children.get(group, ()):
+            self._group_nodes.pop(child, None)
+            self._group_depths.pop(child, None)
+            self._forget_nested_groups(child)
+
+    def _combine_entries(self, entries: list[BVHNode], bbox: om.MBoundingBox) -> BVHNode:
+        '''
+        Combine the subtrees of a group into a binary tree using a median split along the longest axis of their centers
+        '''
+        if len(entries) == 1:
+            return entries[0]
+
+        longest_axis = self._find_longest_axis(bbox)
+        sorted_entries = sorted(entries, key=lambda entry: entry.bbox.min[longest_axis] + entry.bbox.max[longest_axis])
+        midpoint = len(sorted_entries) // 2
+
+        children = []
+        for half in (sorted_entries[:midpoint], sorted_entries[midpoint:]):
+            half_bbox = om.MBoundingBox()
+            for entry in half:
+                half_bbox.expand(entry.bbox)
+            children.append(self._combine_entries(half, half_bbox))
+        return BVHNode(bbox, left=children[0], right=children[1])
+
+    def _refit_ancestors(self, node: BVHNode):
+        '''
+        Recompute the bounding boxes of the nodes on the path from the node's parent up to the root
+        '''
+        node = node.parent
+        while node is not None:
+            node.bbox = self._union_bbox(node.left.bbox, node.right.bbox)
+            node = node.parent
+
+    def get_groups(self) -> list[str]:
+        '''
+        Get the full dag paths of all groups the tree was seeded from, empty if it was not seeded from the hierarchy
+        '''
+        return sorted(set().union(*self._group_children.values()))
+
+    def get_group_at_index(self, index: int) -> str:
+        '''
+        Get the full dag path of the group directly holding the mesh at a meshlist index, "" for meshes at the world
+        '''
+        return self.meshlist.mfn_dagpaths[index].fullPathName().rpartition("|")[0].rpartition("|")[0]
+
+    def group_mask(self, group: str) -> int:
+        '''
+        Get the filter mask of all meshes within a group, e.g. to exclude a hidden assembly with `mask & ~group_mask`.
+        Requires the tree to be seeded from the hierarchy
+
+        :param group: the full dag path of the group
+        '''
+        if group not in self._group_children and group not in self._group_meshes:
+            om.MGlobal.displayError(f"No subtree found for group '{group}', was the BVH built with seed_from_hierarchy?")
+            return 0
+        return mesh_filter.mask_from_indices(self._get_group_indices(group))
+
+    @timer.timer_decorator
+    def rebuild_group(self, group: str):
+        '''
+        Rebuild only the subtree of a group, e.g. after its transform changed, and refit the nodes above it. The rest of
+        the tree is left untouched. Requires the tree to be seeded from the hierarchy
+
+        :param group: the full dag path of the group
+        '''
+        if group not in self._group_children and group not in self._group_meshes:
+            om.MGlobal.displayError(f"No subtree found for group '{group}', was the BVH built with seed_from_hierarchy?")
+            return
+        # Groups inside of a median split fallback do not have a subtree of their own, rebuild the closest group above which does
+        while group and group not in self._group_nodes:
+            group = group.rpartition("|")[0]
+
+        for index in self._get_group_indices(group):
+            self.meshlist.invalidate_bbox(index)
+
+        if not group:
+            # Only the world is left, rebuild the whole tree
+            self.root = self._build_group("", self._max_depth)
+        else:
+            node = self._group_nodes[group]
+            new_node = self._build_group(group, self._group_depths[group])
+
+            # Swap the contents of the existing node in place so its parent keeps pointing at it
+            node.bbox = new_node.bbox
+            node.indices = new_node.indices
+            node.left = new_node.left
+            node.right = new_node.right
+            for child in (node.left, node.right):
+                if child:
+                    child.parent = node
+            for key, value in self._group_nodes.items():
+                if value is new_node:
+                    self._group_nodes[key] = node
+            self._refit_ancestors(node)
+
+        # Cached sub-BVHs, eligible nodes and the culled roots refer to the old tree
+        self._eligible_nodes.clear()
+        self._filtered_bvhs.clear()
+        self._filter_uses.clear()
+        self.cull(self.meshlist, self._frustum)
+
     def pprint(self, node: BVHNode, depth = 0):
         '''
         Pretty print function to inspect the tree structure
@@ -94,10 +344,262 @@ class BVH(AccelerationStructure):
         if node.right:
             self.pprint(node.right, depth+1)
 
-    def find_intersections(self, node: BVHNode, heap: priority_set.PrioritySet, meshlist: meshlist.MFnMeshList, ray: ray.Ray, depth = 0) -> priority_set.PrioritySet:
+    def _surface_area(self, bbox: om.MBoundingBox) -> float:
+        return 2.0 * (bbox.width * bbox.height + bbox.height * bbox.depth + bbox.depth * bbox.width)
+
+    def _overlap_volume(self, a: om.MBoundingBox, b: om.MBoundingBox) -> float:
+        extents = [min(a.max[axis], b.max[axis]) - max(a.min[axis], b.min[axis]) for axis in range(3)]
+        if min(extents) <= 0:
+            return 0.0
+        return extents[0] * extents[1] * extents[2]
+
+    def _union_bbox(self, a: om.MBoundingBox, b: om.MBoundingBox) -> om.MBoundingBox:
+        bbox = om.MBoundingBox(a)
+        bbox.expand(b)
+        return bbox
+
+    def metrics(self) -> dict:
+        '''
+        Compute quality metrics of the tree. The SAH cost estimates the expected cost of a query for a random ray
+        hitting the root, lower values mean a better tree
+
+        :return: A dict containing the sah_cost, node_count, leaf_count, average_leaf_size, sibling_overlap_volume
+                 and the depth_histogram mapping a depth to the amount of leaves at that depth
+        '''
+        root_area = self._surface_area(self.root.bbox)
+        if root_area == 0:
+            root_area = 1.0
+
+        sah_cost = 0.0
+        node_count = 0
+        leaf_count = 0
+        leaf_sizes = 0
+        overlap_volume = 0.0
+        depth_histogram = {}
+
+        stack = [(self.root, 0)]
+        while stack:
+            node, depth = stack.pop()
+            node_count = node_count + 1
+            probability = self._surface_area(node.bbox) / root_area
+            if node.indices is not None:
+                leaf_count = leaf_count + 1
+                leaf_sizes = leaf_sizes + len(node.indices)
+                depth_histogram[depth] = depth_histogram.get(depth, 0) + 1
+                sah_cost = sah_cost + probability * len(node.indices) * BVH.INTERSECTION_COST
+                continue
+
+            sah_cost = sah_cost + probability * BVH.TRAVERSAL_COST
+            if node.left and node.right:
+                overlap_volume = overlap_volume + self._overlap_volume(node.left.bbox, node.right.bbox)
+            if node.left:
+                stack.append((node.left, depth + 1))
+            if node.right:
+                stack.append((node.right, depth + 1))
+
+        return {
+            "sah_cost": sah_cost,
+            "node_count": node_count,
+            "leaf_count": leaf_count,
+            "average_leaf_size": leaf_sizes / leaf_count if leaf_count else 0.0,
+            "sibling_overlap_volume": overlap_volume,
+            "depth_histogram": dict(sorted(depth_histogram.items())),
+        }
+
+    def _rotate(self, node: BVHNode, locked: set[BVHNode] = ()) -> float:
+        '''
+        Try swapping one child of the node with a grandchild from the other side and apply the rotation which reduces
+        the surface area of the modified child the most. The bbox of the node itself stays the same as it still contains
+        the same meshes, therefore only the modified child changes the SAH cost
+
+        :param locked: nodes whose set of meshes must not change, i.e. which may not be the modified child
+
+        :return: The reduction in surface area, 0 if no rotation was applied
+        '''
+        left = node.left
+        right = node.right
+        best_gain = 0.0
+        best_rotation = None
+
+        # Swap the left child with one of the right grandchildren
+        if right.indices is None and right not in locked:
+            old_area = self._surface_area(right.bbox)
+            for grandchild, other in (("left", right.right), ("right", right.left)):
+                gain = old_area - self._surface_area(self._union_bbox(left.bbox, other.bbox))
+                if gain > best_gain:
+                    best_gain = gain
+                    best_rotation = ("left", right, grandchild)
+        # Swap the right child with one of the left grandchildren
+        if left.indices is None and left not in locked:
+            old_area = self._surface_area(left.bbox)
+            for grandchild, other in (("left", left.right), ("right", left.left)):
+                gain = old_area - self._surface_area(self._union_bbox(right.bbox, other.bbox))
+                if gain > best_gain:
+                    best_gain = gain
+                    best_rotation = ("right", left, grandchild)
+
+        if best_rotation is None:
+            return 0.0
+
+        child_name, modified, grandchild_name = best_rotation
+        child = getattr(node, child_name)
+        grandchild = getattr(modified, grandchild_name)
+        setattr(node, child_name, grandchild)
+        setattr(modified, grandchild_name, child)
+        grandchild.parent = node
+        child.parent = modified
+        modified.bbox = self._union_bbox(modified.left.bbox, modified.right.bbox)
+        return best_gain
+
+    @timer.timer_decorator
+    def optimize(self, time_budget_ms: float = 50, max_passes: int = 8) -> dict:
+        '''
+        Lower the SAH cost of the existing tree using node rotations without rebuilding it. Each pass visits all internal
+        nodes bottom-up and applies the best rotation per node, stopping once a pass yields no improvement, max_passes
+        is reached or the time budget is exhausted
+
+        :param time_budget_ms: the time in milliseconds after which no further rotation is attempted, even mid-pass. The
+                               final re-cull and metrics are computed on top of it
+
+        :return: The metrics of the optimized tree
         '''
-        Recursively find intersections and store them in an ordered heap such that intersections get ordered by minimal distance
+        start = time.perf_counter()
+        out_of_time = False
+        # Rotating into the subtree of a group would mix meshes of other groups into it and break rebuild_group()
+        group_nodes = set(self._group_nodes.values())
+        for _ in range(max_passes):
+            # Collect the internal nodes in pre-order and reverse it to rotate children before their parents
+            internal_nodes = []
+            stack = [self.root]
+            while stack:
+                node = stack.pop()
+                if node.indices is not None:
+                    continue
+                internal_nodes.append(node)
+                stack.append(node.left)
+                stack.append(node.right)
+
+            gain = 0.0
+            for node in reversed(internal_nodes):
+                # A single pass over a large tree can take longer than the whole budget, check it per node
+                if (time.perf_counter() - start) * 1000 > time_budget_ms:
+                    out_of_time = True
+                    break
+                gain = gain + self._rotate(node, group_nodes)
+
+            if gain <= 0 or out_of_time:
+                break
+
+        # Rotations move nodes between subtrees, re-cull to keep the query roots consistent
+        self._eligible_nodes.clear()
+        self.cull(self.meshlist, self._frustum)
+        return self.metrics()
+
+    def _collect_visible(self, node: BVHNode, view_frustum: frustum.Frustum, roots: list[BVHNode]):
+        '''
+        Recursively collect the largest subtrees which are (partially) contained in the frustum. Subtrees fully inside
+        of the frustum are added as a whole without checking their children
+        '''
+        classification = view_frustum.classify_bbox(node.bbox)
+        if classification == frustum.OUTSIDE:
+            return
+        if classification == frustum.INSIDE or node.indices is not None:
+            roots.append(node)
+            return
+
+        if node.left:
+            self._collect_visible(node.left, view_frustum, roots)
+        if node.right:
+            self._collect_visible(node.right, view_frustum, roots)
+
+    @timer.timer_decorator
+    def cull(self, meshes: meshlist.MFnMeshList, view_frustum: frustum.Frustum):
+        '''
+        Restrict get_closest_intersection and the queries passed use_cull to the subtrees visible in the given frustum.
+        Passing None resets the query roots to the full tree
+        '''
+        self._frustum = view_frustum
+        for filtered_bvh in self._filtered_bvhs.values():
+            filtered_bvh.cull(meshes, view_frustum)
+        if view_frustum is None:
+            self._roots = [self.root]
+            return
+        self._roots = []
+        self._collect_visible(self.root, view_frustum, self._roots)
+
+    def _get_eligible_nodes(self, mask: int) -> set[BVHNode]:
+        '''
+        Get the nodes whose subtree contains at least one mesh passing the filter, used to prune subtrees during filtered
+        queries. Computed once per filter and cached rather than storing a mask on every node, which would take memory
+        quadratic in the amount of meshes
+        '''
+        eligible = self._eligible_nodes.get(mask)
+        if eligible is not None:
+            return eligible
+
+        eligible_indices = mesh_filter.indices_from_mask(mask)
+        eligible = set()
+        # Post-order traversal such that both children are classified before their parent
+        stack = [(self.root, False)]
+        while stack:
+            node, children_done = stack.pop()
+            if node.indices is not None:
+                if not eligible_indices.isdisjoint(node.indices):
+                    eligible.add(node)
+            elif children_done:
+                if node.left in eligible or node.right in eligible:
+                    eligible.add(node)
+            else:
+                stack.append((node, True))
+                for child in (node.left, node.right):
+                    if child:
+                        stack.append((child, False))
+        self._eligible_nodes.put(mask, eligible)
+        return eligible
+
+    def _get_query_roots(self, use_cull: bool) -> list[BVHNode]:
+        '''
+        Get the subtrees a query starts from, either those visible in the culled frustum or the whole tree
+        '''
+        return list(self._roots) if use_cull else [self.root]
+
+    def _get_filtered_bvh(self, mask: int):
         '''
+        Get the dedicated sub-BVH of a filter once it has been used FILTER_BUILD_THRESHOLD times, building it if needed.
+        Filters which are not used frequently enough are instead handled by pruning the full tree during traversal
+
+        :return: The sub-BVH or None if the full tree should be traversed
+        '''
+        filtered_bvh = self._filtered_bvhs.get(mask)
+        if filtered_bvh:
+            return filtered_bvh
+
+        uses = self._filter_uses.get(mask, 0) + 1
+        self._filter_uses.put(mask, uses)
+        if uses < BVH.FILTER_BUILD_THRESHOLD:
+            return None
+
+        indices = sorted(index for index in mesh_filter.indices_from_mask(mask) if index < len(self.meshlist))
+        if len(indices) == 0:
+            return None
+        bbox = om.MBoundingBox()
+        for index in indices:
+            bbox.expand(self.meshlist.get_bbox_at_index(index))
+        filtered_bvh = BVH(self.meshlist, bbox, self._max_depth, self._sample_count, indices)
+        filtered_bvh.cull(self.meshlist, self._frustum)
+        self._filtered_bvhs.put(mask, filtered_bvh)
+        return filtered_bvh
+
+    def find_intersections(self, node: BVHNode, heap: priority_set.PrioritySet, meshlist: meshlist.MFnMeshList, ray: ray.Ray, depth = 0, mask: int = None,
+                           eligible: set[BVHNode] = None) -> priority_set.PrioritySet:
+        '''
+        Recursively find intersections and store them in an ordered heap such that intersections get ordered by minimal distance.
+        If a filter mask is given, subtrees without any eligible meshes are skipped entirely
+
+        :param eligible: the nodes containing eligible meshes as returned by _get_eligible_nodes(mask)
+        '''
+        if eligible is not None and node not in eligible:
+            return heap
         if not ray.intersect_bbox(node.bbox):
             return heap
         
@@ -108,26 +610,35 @@ class BVH(AccelerationStructure):
         if node.indices:
             distance = ray.origin.distanceTo(node.bbox.center)
             for index in node.indices:
-                heap.add(index, -distance)
+                if mesh_filter.is_eligible(mask, index):
+                    heap.add(index, -distance)
 
         if node.left:
-            self.find_intersections(node.left, heap, meshlist, ray, depth+1)
+            self.find_intersections(node.left, heap, meshlist, ray, depth+1, mask, eligible)
         if node.right:
-            self.find_intersections(node.right, heap, meshlist, ray, depth+1)
+            self.find_intersections(node.right, heap, meshlist, ray, depth+1, mask, eligible)
 
     @timer.timer_decorator
-    def get_closest_intersection(self, meshes: meshlist.MFnMeshList, ray:ray.Ray):
+    def get_closest_intersection(self, meshes: meshlist.MFnMeshList, ray:ray.Ray, mask: int = None):
         '''
         Get the closest intersection point for a given ray in a list of meshes
 
         :param bvh: The Bounding Volume Hierarchy to be used for the acceleration of mesh collision checks
         :param meshes: the meshlist of the whole scene to iterate over
         :param ray: The ray to cast the intersection from
+        :param mask: optional filter bitmask over the meshlist indices, see util.maya.mesh_filter
 
         :return: The mesh name the intersection was found for and the hit position or None
         '''
+        if mask is not None:
+            filtered_bvh = self._get_filtered_bvh(mask)
+            if filtered_bvh:
+                return filtered_bvh.get_closest_intersection(meshes, ray)
+
+        eligible = self._get_eligible_nodes(mask) if mask is not None else None
         indices_heap = priority_set.PrioritySet()
-        self.find_intersections(self.root, indices_heap, meshes, ray)
+        for root in self._roots:
+            self.find_intersections(root, indices_heap, meshes, ray, mask=mask, eligible=eligible)
         ray.create_debug_visualizer(scale=1000)
 
         # Convert to MFloatPoint ahead of time to avoid doing it for every mesh iteration
@@ -166,4 +677,191 @@ class BVH(AccelerationStructure):
 
         # No intersection handling
         om.MGlobal.displayWarning(f"No intersection found for ray [{ray}]")
-        return None
\ No newline at end of file
+        return None
+
+    @timer.timer_decorator
+    def closest_hit(self, meshes: meshlist.MFnMeshList, ray: ray.Ray, max_distance: float = None, mask: int = None, use_cull: bool = False):
+        '''
+        Get the closest hit within max_distance without any warning on a miss, meant for casting large batches of rays.
+        The nodes are visited ordered by the ray parameter at which they are entered, such that the traversal stops
+        once the next node starts beyond the closest confirmed hit
+
+        :param meshes: the meshlist of the whole scene to iterate over
+        :param ray: The ray to cast the intersection from
+        :param max_distance: the maximum distance along the ray to consider, unlimited if None
+        :param mask: optional filter bitmask over the meshlist indices, see util.maya.mesh_filter
+        :param use_cull: only consider what is visible in the frustum passed to cull(). Off by default such that e.g.
+                         occlusion checks are not affected by the last camera the structure was culled against
+
+        :return: A tuple of (mesh name, hit position, distance) or None
+        '''
+        if mask is not None:
+            filtered_bvh = self._get_filtered_bvh(mask)
+            if filtered_bvh:
+                return filtered_bvh.closest_hit(meshes, ray, max_distance, use_cull=use_cull)
+
+        # Convert to MFloatPoint ahead of time to avoid doing it for every mesh iteration
+        ray_origin = om.MFloatPoint(ray.origin)
+        ray_direction = om.MFloatVector(ray.direction)
+        best_param = self._get_max_param(ray, max_distance)
+        best_hit = None
+        eligible = self._get_eligible_nodes(mask) if mask is not None else None
+
+        heap = []
+        counter = itertools.count()     # Tie breaker such that nodes themselves never get compared
+        for root in self._get_query_roots(use_cull):
+            bbox_range = ray.intersect_bbox_range(root.bbox)
+            if bbox_range and bbox_range[0] <= best_param:
+                heapq.heappush(heap, (bbox_range[0], next(counter), root))
+
+        while heap:
+            t_enter, _, node = heapq.heappop(heap)
+            # No node entered beyond the closest hit can contain a closer one
+            if t_enter > best_param:
+                break
+            if eligible is not None and node not in eligible:
+                continue
+
+            if node.indices is not None:
+                for index in node.indices:
+                    if not mesh_filter.is_eligible(mask, index):
+                        continue
+                    mesh_range = ray.intersect_bbox_range(meshes.get_bbox_at_index(index))
+                    if not mesh_range or mesh_range[0] > best_param:
+                        continue
+                    intersection_point = meshes.mfn_meshes[index].closestIntersection(ray_origin,              # raySource
+                                                                                      ray_direction,           # rayDirection
+                                                                                      om.MSpace.kWorld,        # space
+                                                                                      best_param,              # maxParam
+                                                                                      False)                   # testBothDirections
+                    if intersection_point and intersection_point[1] <= best_param:
+                        best_param = intersection_point[1]
+                        best_hit = (index, intersection_point[0])
+                continue
+
+            for child in (node.left, node.right):
+                if child is None:
+                    continue
+                bbox_range = ray.intersect_bbox_range(child.bbox)
+                if bbox_range and bbox_range[0] <= best_param:
+                    heapq.heappush(heap, (bbox_range[0], next(counter), child))
+
+        if best_hit is None:
+            return None
+        index, point = best_hit
+        return (meshes.get_name_at_index(index), point, ray_origin.distanceTo(point))
+
+    @timer.timer_decorator
+    def any_hit(self, meshes: meshlist.MFnMeshList, ray: ray.Ray, max_distance: float = None, mask: int = None, use_cull: bool = False):
+        '''
+        Check whether the ray hits any mesh within max_distance, returning as soon as the first hit is found. Unlike
+        get_closest_intersection the tree is traversed depth-first without ordering the nodes by distance
+
+        :param meshes: the meshlist of the whole scene to iterate over
+        :param ray: The ray to cast the intersection from
+        :param max_distance: the maximum distance along the ray to consider, unlimited if None
+        :param mask: optional filter bitmask over the meshlist indices, see util.maya.mesh_filter
+        :param use_cull: only consider what is visible in the frustum passed to cull(). Off by default such that e.g.
+                         occlusion checks are not affected by the last camera the structure was culled against
+
+        :return: The mesh name of the first found hit and the hit position or None
+        '''
+        if mask is not None:
+            filtered_bvh = self._get_filtered_bvh(mask)
+            if filtered_bvh:
+                return filtered_bvh.any_hit(meshes, ray, max_distance, use_cull=use_cull)
+
+        max_param = self._get_max_param(ray, max_distance)
+        eligible = self._get_eligible_nodes(mask) if mask is not None else None
+
+        # Convert to MFloatPoint ahead of time to avoid doing it for every mesh iteration
+        ray_origin = om.MFloatPoint(ray.origin)
+        ray_direction = om.MFloatVector(ray.direction)
+
+        stack = self._get_query_roots(use_cull)
+        while stack:
+            node = stack.pop()
+            if eligible is not None and node not in eligible:
+                continue
+            bbox_range = ray.intersect_bbox_range(node.bbox)
+            if not bbox_range or bbox_range[0] > max_param:
+                continue
+
+            if node.indices is not None:
+                for index in node.indices:
+                    if not mesh_filter.is_eligible(mask, index):
+                        continue
+                    intersection_point = meshes.mfn_meshes[index].anyIntersection(ray_origin,              # raySource
+                                                                                  ray_direction,           # rayDirection
+                                                                                  om.MSpace.kWorld,        # space
+                                                                                  max_param,               # maxParam
+                                                                                  False)                   # testBothDirections
+                    if intersection_point:
+                        return (meshes.get_name_at_index(index), intersection_point[0])
+                continue
+
+            if node.right:
+                stack.append(node.right)
+            if node.left:
+                stack.append(node.left)
+        return None
+
+    @timer.timer_decorator
+    def all_hits(self, meshes: meshlist.MFnMeshList, ray: ray.Ray, max_distance: float = None, limit: int = None, mask: int = None, use_cull: bool = False):
+        '''
+        Get the closest hit of every mesh the ray passes through within max_distance, ordered by distance
+
+        :param meshes: the meshlist of the whole scene to iterate over
+        :param ray: The ray to cast the intersection from
+        :param max_distance: the maximum distance along the ray to consider, unlimited if None
+        :param limit: the maximum amount of hits to return, all hits if None
+        :param mask: optional filter bitmask over the meshlist indices, see util.maya.mesh_filter
+        :param use_cull: only consider what is visible in the frustum passed to cull(). Off by default such that e.g.
+                         occlusion checks are not affected by the last camera the structure was culled against
+
+        :return: A list of (mesh name, hit position, distance) tuples sorted by distance
+        '''
+        if mask is not None:
+            filtered_bvh = self._get_filtered_bvh(mask)
+            if filtered_bvh:
+                return filtered_bvh.all_hits(meshes, ray, max_distance, limit, use_cull=use_cull)
+
+        max_param = self._get_max_param(ray, max_distance)
+        eligible = self._get_eligible_nodes(mask) if mask is not None else None
+
+        # Convert to MFloatPoint ahead of time to avoid doing it for every mesh iteration
+        ray_origin = om.MFloatPoint(ray.origin)
+        ray_direction = om.MFloatVector(ray.direction)
+
+        hits = []
+        stack = self._get_query_roots(use_cull)
+        while stack:
+            node = stack.pop()
+            if eligible is not None and node not in eligible:
+                continue
+            bbox_range = ray.intersect_bbox_range(node.bbox)
+            if not bbox_range or bbox_range[0] > max_param:
+                continue
+
+            if node.indices is not None:
+                for index in node.indices:
+                    if not mesh_filter.is_eligible(mask, index):
+                        continue
+                    intersection_point = meshes.mfn_meshes[index].closestIntersection(ray_origin,              # raySource
+                                                                                      ray_direction,           # rayDirection
+                                                                                      om.MSpace.kWorld,        # space
+                                                                                      max_param,               # maxParam
+                                                                                      False)                   # testBothDirections
+                    if intersection_point:
+                        hits.append((meshes.get_name_at_index(index), intersection_point[0], ray_origin.distanceTo(intersection_point[0])))
+                continue
+
+            if node.right:
+                stack.append(node.right)
+            if node.left:
+                stack.append(node.left)
+
+        hits.sort(key=lambda hit: hit[2])
+        if limit is not None:
+            return hits[:limit]
+        return hits
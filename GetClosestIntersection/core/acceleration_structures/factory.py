@@ -0,0 +1,34 @@
+import maya.api.OpenMaya as om
+
+import GetClosestIntersection.constants as constants
+
+from GetClosestIntersection.core.acceleration_structures.base import AccelerationStructure
+from GetClosestIntersection.core.acceleration_structures.bruteforce import BruteForce
+from GetClosestIntersection.core.acceleration_structures.bvh import BVH
+from GetClosestIntersection.core.acceleration_structures.grid import Grid
+from GetClosestIntersection.core.acceleration_structures.octree import Octree
+
+import GetClosestIntersection.util.maya.meshlist as meshlist
+
+
+def create_acceleration_structure(meshlist: meshlist.MFnMeshList, name: str = None) -> AccelerationStructure:
+    '''
+    Build the acceleration structure of the given name over a meshlist
+
+    :param name: One of {'None', 'Octree', 'BVH', 'Grid'}, defaults to the ACCELERATION_STRUCTURE specified in constants.py
+
+    :return: The acceleration structure or None if the name is invalid
+    '''
+    if name is None:
+        name = constants.ACCELERATION_STRUCTURE
+
+    if name == "BVH":
+        return BVH(meshlist, meshlist.bbox, seed_from_hierarchy=constants.BVH_SEED_FROM_HIERARCHY)
+    elif name == "Octree":
+        return Octree(meshlist, meshlist.bbox)
+    elif name == "Grid":
+        return Grid(meshlist, meshlist.bbox)
+    elif name == "None":
+        return BruteForce()
+    om.MGlobal.displayError("Invalid choice of Acceleration structure, valid options are: {'None', 'Octree', 'BVH', 'Grid'} ")
+    return None
@@ -0,0 +1,328 @@
+import array
+
+import maya.api.OpenMaya as om
+
+import GetClosestIntersection.constants as constants
+
+from GetClosestIntersection.core.acceleration_structures.base import AccelerationStructure
+import GetClosestIntersection.core.ray as ray
+import GetClosestIntersection.core.frustum as frustum
+
+import GetClosestIntersection.util.maya.meshlist as meshlist
+import GetClosestIntersection.util.maya.mesh_filter as mesh_filter
+import GetClosestIntersection.util.timer as timer
+import GetClosestIntersection.util.debug as debug
+
+
+class Grid(AccelerationStructure):
+    '''
+    Uniform grid over the scene bounding box which is traversed front-to-back using a 3D-DDA. The cell contents are
+    stored in CSR layout, the meshes of cell i are indices[offsets[i]:offsets[i+1]]
+    '''
+
+    @timer.timer_decorator
+    def __init__(self, meshlist: meshlist.MFnMeshList, bbox: om.MBoundingBox, density = 2.0, max_resolution = 128):
+        '''
+        :param density: the target amount of cells per mesh, the resolution per axis is derived from it and the scene extents
+        :param max_resolution: the maximum amount of cells along a single axis
+        '''
+        if density <= 0:
+            om.MGlobal.displayError(f"{self.__init__.__qualname__} density parameter must be greater than 0")
+        if max_resolution < 1:
+            om.MGlobal.displayError(f"{self.__init__.__qualname__} max_resolution parameter must be greater than 0")
+        self.bbox = bbox
+        self.resolution = self._compute_resolution(bbox, len(meshlist), density, max_resolution)
+        self.cell_size = [(bbox.max[axis] - bbox.min[axis]) / self.resolution[axis] for axis in range(3)]
+        self.offsets, self.indices = self._build(meshlist)
+        self._visible = None
+
+    def _compute_resolution(self, bbox: om.MBoundingBox, count: int, density: float, max_resolution: int) -> list[int]:
+        '''
+        Choose the amount of cells per axis such that the grid holds roughly count*density cells of near-cubic shape.
+        Flat axes get a single cell and the density is distributed over the remaining axes only, e.g. by area for a
+        planar scene
+        '''
+        extents = [bbox.max[axis] - bbox.min[axis] for axis in range(3)]
+        spanned = [extent for extent in extents if extent > 1e-6]
+        if not spanned:
+            return [1, 1, 1]
+        measure = 1.0
+        for extent in spanned:
+            measure *= extent
+        cells_per_unit = ((count * density) / measure) ** (1.0 / len(spanned))
+        return [min(max(int(round(extent * cells_per_unit)), 1), max_resolution) if extent > 1e-6 else 1 for extent in extents]
+
+    def _cell_coord(self, value: float, axis: int) -> int:
+        '''
+        Get the cell coordinate along an axis for a world space value, clamped to the grid
+        '''
+        if self.cell_size[axis] == 0:
+            return 0
+        coord = int((value - self.bbox.min[axis]) / self.cell_size[axis])
+        return min(max(coord, 0), self.resolution[axis] - 1)
+
+    def _cell_range(self, bbox: om.MBoundingBox) -> list[range]:
+        return [range(self._cell_coord(bbox.min[axis], axis), self._cell_coord(bbox.max[axis], axis) + 1) for axis in range(3)]
+
+    def _build(self, meshlist: meshlist.MFnMeshList) -> tuple[array.array, array.array]:
+        '''
+        Fill the grid in two passes, the first counts the meshes per cell to compute the offsets and the second writes
+        the mesh indices into a single preallocated index buffer
+        '''
+        nx, ny, nz = self.resolution
+        counts = array.array('L', [0]) * (nx * ny * nz + 1)
+        cell_ranges = [self._cell_range(meshlist.get_bbox_at_index(index)) for index in range(len(meshlist))]
+
+        for x_range, y_range, z_range in cell_ranges:
+            for z in z_range:
+                for y in y_range:
+                    for x in x_range:
+                        counts[x + y * nx + z * nx * ny + 1] += 1
+
+        # Exclusive prefix sum, offsets[i] is the start of cell i in the index buffer
+        offsets = counts
+        for i in range(1, len(offsets)):
+            offsets[i] += offsets[i - 1]
+
+        indices = array.array('L', [0]) * offsets[-1]
+        cursor = array.array('L', offsets[:-1])
+        for index, (x_range, y_range, z_range) in enumerate(cell_ranges):
+            for z in z_range:
+                for y in y_range:
+                    for x in x_range:
+                        cell = x + y * nx + z * nx * ny
+                        indices[cursor[cell]] = index
+                        cursor[cell] += 1
+        return offsets, indices
+
+    def _cell_bbox(self, x: int, y: int, z: int) -> om.MBoundingBox:
+        bbox_min = om.MPoint(self.bbox.min[0] + x * self.cell_size[0], self.bbox.min[1] + y * self.cell_size[1], self.bbox.min[2] + z * self.cell_size[2])
+        bbox_max = om.MPoint(bbox_min[0] + self.cell_size[0], bbox_min[1] + self.cell_size[1], bbox_min[2] + self.cell_size[2])
+        return om.MBoundingBox(bbox_min, bbox_max)
+
+    def _traverse(self, ray: ray.Ray, max_param: float):
+        '''
+        Generator walking the cells pierced by the ray front-to-back using a 3D-DDA
+
+        :return: A generator yielding tuples of (cell_index, t_exit) where t_exit is the ray parameter at which the ray leaves the cell
+        '''
+        bbox_range = ray.intersect_bbox_range(self.bbox)
+        if not bbox_range or bbox_range[0] > max_param:
+            return
+        t_enter, t_limit = bbox_range
+        t_limit = min(t_limit, max_param)
+
+        entry_point = ray.origin + ray.direction * t_enter
+        coords = [self._cell_coord(entry_point[axis], axis) for axis in range(3)]
+        step = [0, 0, 0]
+        t_max = [float('inf')] * 3
+        t_delta = [float('inf')] * 3
+        for axis in range(3):
+            direction = ray.direction[axis]
+            # Flat axes only have a single cell which the ray never leaves along that axis
+            if self.cell_size[axis] == 0:
+                continue
+            if direction > 0:
+                step[axis] = 1
+                boundary = self.bbox.min[axis] + (coords[axis] + 1) * self.cell_size[axis]
+                t_max[axis] = (boundary - ray.origin[axis]) / direction
+                t_delta[axis] = self.cell_size[axis] / direction
+            elif direction < 0:
+                step[axis] = -1
+                boundary = self.bbox.min[axis] + coords[axis] * self.cell_size[axis]
+                t_max[axis] = (boundary - ray.origin[axis]) / direction
+                t_delta[axis] = -self.cell_size[axis] / direction
+
+        nx, ny, nz = self.resolution
+        while True:
+            if constants.DEBUG:
+                debug.create_cube("gridDebugCube", self._cell_bbox(*coords), color=(0, 1, 0), group="Grid")
+
+            t_exit = min(t_max)
+            yield coords[0] + coords[1] * nx + coords[2] * nx * ny, t_exit
+            if t_exit >= t_limit:
+                return
+
+            axis = t_max.index(t_exit)
+            coords[axis] += step[axis]
+            if coords[axis] < 0 or coords[axis] >= self.resolution[axis]:
+                return
+            t_max[axis] += t_delta[axis]
+
+    def _cell_indices(self, cell: int) -> array.array:
+        return self.indices[self.offsets[cell]:self.offsets[cell + 1]]
+
+    def find_intersections(self, ray: ray.Ray, max_param: float = 9999999, mask: int = None, use_cull: bool = True) -> list[int]:
+        '''
+        Find all the mesh indices stored in the cells pierced by the ray which pass the filter mask, restricted to the
+        meshes visible in the culled frustum if use_cull is set
+
+        :return: The unique mesh indices ordered by the cell they were first encountered in
+        '''
+        visible = self._visible if use_cull else None
+        found = []
+        tested = set()
+        for cell, _ in self._traverse(ray, max_param):
+            for index in self._cell_indices(cell):
+                if index in tested or (visible is not None and index not in visible) or not mesh_filter.is_eligible(mask, index):
+                    continue
+                tested.add(index)
+                found.append(index)
+        return found
+
+    @timer.timer_decorator
+    def cull(self, meshes: meshlist.MFnMeshList, view_frustum: frustum.Frustum):
+        '''
+        Restrict get_closest_intersection and the queries passed use_cull to the meshes whose bounding box is visible
+        in the given frustum. Passing None resets the queries to all meshes
+        '''
+        if view_frustum is None:
+            self._visible = None
+            return
+        self._visible = {i for i in range(len(meshes)) if view_frustum.classify_bbox(meshes.get_bbox_at_index(i)) != frustum.OUTSIDE}
+
+    @timer.timer_decorator
+    def get_closest_intersection(self, meshes: meshlist.MFnMeshList, ray: ray.Ray, mask: int = None):
+        '''
+        Get the closest intersection point for a given ray in a list of meshes. As the cells are walked front-to-back the
+        traversal stops at the first cell whose exit lies beyond the closest confirmed hit
+
+        :param meshes: the meshlist of the whole scene to iterate over
+        :param ray: The ray to cast the intersection from
+        :param mask: optional filter bitmask over the meshlist indices, see util.maya.mesh_filter
+
+        :return: The mesh name the intersection was found for and the hit position or None
+        '''
+        ray.create_debug_visualizer(scale=1000)
+
+        hit = self.closest_hit(meshes, ray, mask=mask, use_cull=True)
+        if hit:
+            return hit[:2]
+
+        # No intersection handling
+        om.MGlobal.displayWarning(f"No intersection found for ray [{ray}]")
+        return None
+
+    @timer.timer_decorator
+    def closest_hit(self, meshes: meshlist.MFnMeshList, ray: ray.Ray, max_distance: float = None, mask: int = None, use_cull: bool = False):
+        '''
+        Get the closest hit within max_distance without any warning on a miss, meant for casting large batches of rays.
+        As the cells are walked front-to-back the traversal stops at the first cell whose exit lies beyond the closest
+        confirmed hit
+
+        :param meshes: the meshlist of the whole scene to iterate over
+        :param max_distance: the maximum distance along the ray to consider, unlimited if None
+        :param mask: optional filter bitmask over the meshlist indices, see util.maya.mesh_filter
+        :param use_cull: only consider what is visible in the frustum passed to cull(). Off by default such that e.g.
+                         occlusion checks are not affected by the last camera the structure was culled against
+
+        :return: A tuple of (mesh name, hit position, distance) or None
+        '''
+        # Convert to MFloatPoint ahead of time to avoid doing it for every mesh iteration
+        ray_origin = om.MFloatPoint(ray.origin)
+        ray_direction = om.MFloatVector(ray.direction)
+        max_param = self._get_max_param(ray, max_distance)
+
+        visible = self._visible if use_cull else None
+        best_param = max_param
+        best_hit = None
+        tested = set()      # Meshes spanning multiple cells only need to be tested once
+        for cell, t_exit in self._traverse(ray, max_param):
+            for index in self._cell_indices(cell):
+                if index in tested or (visible is not None and index not in visible) or not mesh_filter.is_eligible(mask, index):
+                    continue
+                tested.add(index)
+                mesh_range = ray.intersect_bbox_range(meshes.get_bbox_at_index(index))
+                if not mesh_range or mesh_range[0] > best_param:
+                    continue
+                intersection_point = meshes.mfn_meshes[index].closestIntersection(ray_origin,              # raySource
+                                                                                  ray_direction,           # rayDirection
+                                                                                  om.MSpace.kWorld,        # space
+                                                                                  best_param,              # maxParam
+                                                                                  False)                   # testBothDirections
+                if intersection_point and (best_hit is None or intersection_point[1] < best_param):
+                    best_param = intersection_point[1]
+                    best_hit = (index, intersection_point[0])
+
+            # A hit within this cell can not be beaten by any of the cells further down the ray
+            if best_hit is not None and best_param <= t_exit:
+                break
+
+        if best_hit is None:
+            return None
+        index, point = best_hit
+        return (meshes.get_name_at_index(index), point, ray_origin.distanceTo(point))
+
+    @timer.timer_decorator
+    def any_hit(self, meshes: meshlist.MFnMeshList, ray: ray.Ray, max_distance: float = None, mask: int = None, use_cull: bool = False):
+        '''
+        Check whether the ray hits any mesh within max_distance, returning as soon as the first hit is found
+
+        :param meshes: the meshlist of the whole scene to iterate over
+        :param max_distance: the maximum distance along the ray to consider, unlimited if None
+        :param mask: optional filter bitmask over the meshlist indices, see util.maya.mesh_filter
+        :param use_cull: only consider what is visible in the frustum passed to cull(). Off by default such that e.g.
+                         occlusion checks are not affected by the last camera the structure was culled against
+
+        :return: The mesh name of the first found hit and the hit position or None
+        '''
+        # Convert to MFloatPoint ahead of time to avoid doing it for every mesh iteration
+        ray_origin = om.MFloatPoint(ray.origin)
+        ray_direction = om.MFloatVector(ray.direction)
+        max_param = self._get_max_param(ray, max_distance)
+
+        for index in self.find_intersections(ray, max_param, mask, use_cull):
+            intersection_point = meshes.mfn_meshes[index].anyIntersection(ray_origin,              # raySource
+                                                                          ray_direction,           # rayDirection
+                                                                          om.MSpace.kWorld,        # space
+                                                                          max_param,               # maxParam
+                                                                          False)                   # testBothDirections
+            if intersection_point:
+                return (meshes.get_name_at_index(index), intersection_point[0])
+        return None
+
+    @timer.timer_decorator
+    def all_hits(self, meshes: meshlist.MFnMeshList, ray: ray.Ray, max_distance: float = None, limit: int = None, mask: int = None, use_cull: bool = False):
+        '''
+        Get the closest hit of every mesh the ray passes through within max_distance, ordered by distance. If a limit is
+        given the traversal stops once the limit-th closest hit lies within the current cell
+
+        :param meshes: the meshlist of the whole scene to iterate over
+        :param max_distance: the maximum distance along the ray to consider, unlimited if None
+        :param limit: the maximum amount of hits to return, all hits if None
+        :param mask: optional filter bitmask over the meshlist indices, see util.maya.mesh_filter
+        :param use_cull: only consider what is visible in the frustum passed to cull(). Off by default such that e.g.
+                         occlusion checks are not affected by the last camera the structure was culled against
+
+        :return: A list of (mesh name, hit position, distance) tuples sorted by distance
+        '''
+        # Convert to MFloatPoint ahead of time to avoid doing it for every mesh iteration
+        ray_origin = om.MFloatPoint(ray.origin)
+        ray_direction = om.MFloatVector(ray.direction)
+        max_param = self._get_max_param(ray, max_distance)
+
+        visible = self._visible if use_cull else None
+        hits = []       # (ray parameter, index, hit position)
+        tested = set()
+        for cell, t_exit in self._traverse(ray, max_param):
+            for index in self._cell_indices(cell):
+                if index in tested or (visible is not None and index not in visible) or not mesh_filter.is_eligible(mask, index):
+                    continue
+                tested.add(index)
+                intersection_point = meshes.mfn_meshes[index].closestIntersection(ray_origin,              # raySource
+                                                                                  ray_direction,           # rayDirection
+                                                                                  om.MSpace.kWorld,        # space
+                                                                                  max_param,               # maxParam
+                                                                                  False)                   # testBothDirections
+                if intersection_point:
+                    hits.append((intersection_point[1], index, intersection_point[0]))
+
+            if limit is not None and len(hits) >= limit:
+                hits.sort(key=lambda hit: hit[0])
+                if hits[limit - 1][0] <= t_exit:
+                    break
+
+        hits.sort(key=lambda hit: hit[0])
+        if limit is not None:
+            hits = hits[:limit]
+        return [(meshes.get_name_at_index(index), point, ray_origin.distanceTo(point)) for _, index, point in hits]
@@ -4,8 +4,10 @@ import GetClosestIntersection.constants as constants
 
 from GetClosestIntersection.core.acceleration_structures.base import AccelerationStructure
 import GetClosestIntersection.core.ray as ray
+import GetClosestIntersection.core.frustum as frustum
 
 import GetClosestIntersection.util.maya.meshlist as meshlist
+import GetClosestIntersection.util.maya.mesh_filter as mesh_filter
 import GetClosestIntersection.util.timer as timer
 import GetClosestIntersection.util.debug as debug
 
@@ -19,6 +21,7 @@ class Octree(AccelerationStructure):
     def __init__(self, meshlist: meshlist.MFnMeshList, bbox = om.MBoundingBox(om.MPoint(-1, -1, -1), om.MPoint(1, 1, 1)), depth = 3):
         indices = [i for i in range(len(meshlist.mfn_meshes))]
         self.grid = self._recursive_build(meshlist, indices, bbox, depth)
+        self._visible_grid = self.grid
         self.max_depth = depth
       
     def _does_overlap(self, mesh: om.MFnMesh, dagpath: om.MDagPath, bbox: om.MBoundingBox):
@@ -101,6 +104,35 @@ class Octree(AccelerationStructure):
 
         return split_bbox
    
+    def _prune_to_frustum(self, my_dict: dict, view_frustum: frustum.Frustum) -> dict:
+        '''
+        Recursively build a copy of the octree only containing the nodes which are (partially) contained in the frustum.
+        Nodes fully inside of the frustum are shared with the original tree rather than copied
+        '''
+        visible = {}
+        for bbox, child in my_dict.items():
+            classification = view_frustum.classify_bbox(bbox)
+            if classification == frustum.OUTSIDE:
+                continue
+            if classification == frustum.INSIDE or isinstance(child, list):
+                visible[bbox] = child
+                continue
+            pruned_child = self._prune_to_frustum(child, view_frustum)
+            if len(pruned_child) > 0:
+                visible[bbox] = pruned_child
+        return visible
+
+    @timer.timer_decorator
+    def cull(self, meshes: meshlist.MFnMeshList, view_frustum: frustum.Frustum):
+        '''
+        Restrict get_closest_intersection and the queries passed use_cull to the octree nodes visible in the given
+        frustum. Passing None resets the queries to the full tree
+        '''
+        if view_frustum is None:
+            self._visible_grid = self.grid
+            return
+        self._visible_grid = self._prune_to_frustum(self.grid, view_frustum)
+
     def find_intersections(self, my_dict: dict, indices: set, ray: ray.Ray):
         '''
         Recursively check the bounding boxes for intersections with the ray and modify in-place a set of the indices contained within that cube
@@ -122,17 +154,36 @@ class Octree(AccelerationStructure):
             else:
                 self.find_intersections(my_dict[bbox], indices, ray)
 
+    def _iter_leaves(self, my_dict: dict, ray: ray.Ray, max_param: float):
+        '''
+        Generator counterpart to find_intersections() yielding the index lists of the intersected leaves as soon as they
+        are reached, allowing the caller to stop the traversal early. Nodes entered beyond max_param are skipped
+        '''
+        for bbox, child in my_dict.items():
+            bbox_range = ray.intersect_bbox_range(bbox)
+            if not bbox_range or bbox_range[0] > max_param:
+                continue
+            if constants.DEBUG:
+                debug.create_cube("octreeDebugCube", bbox, color=(0, 0, 1))
+            if isinstance(child, list):
+                yield child
+            else:
+                yield from self._iter_leaves(child, ray, max_param)
+
     @timer.timer_decorator
-    def get_closest_intersection(self, meshes: meshlist.MFnMeshList, ray:ray.Ray):
+    def get_closest_intersection(self, meshes: meshlist.MFnMeshList, ray:ray.Ray, mask: int = None):
         '''
         Get the closest intersection point for a given ray in a list of meshes
 
         :param meshes: the meshlist of the whole scene to iterate over
+        :param mask: optional filter bitmask over the meshlist indices, see util.maya.mesh_filter
 
         :return: The mesh name the intersection was found for and the hit position or None
         '''
         indices = set()
-        self.find_intersections(self.grid, indices, ray)      # Modify indices set in place
+        self.find_intersections(self._visible_grid, indices, ray)      # Modify indices set in place
+        if mask is not None:
+            indices = {index for index in indices if mesh_filter.is_eligible(mask, index)}
 
         # Convert to MFloatPoint ahead of time to avoid doing it for every mesh iteration
         ray_origin = om.MFloatPoint(ray.origin)
@@ -160,3 +211,93 @@ class Octree(AccelerationStructure):
             return None
 
         return (meshes.get_name_at_index(min_index), intersections[min_index])
+
+    @timer.timer_decorator
+    def closest_hit(self, meshes: meshlist.MFnMeshList, ray: ray.Ray, max_distance: float = None, mask: int = None, use_cull: bool = False):
+        '''
+        Get the closest hit within max_distance without any warning on a miss, meant for casting large batches of rays
+
+        :param meshes: the meshlist of the whole scene to iterate over
+        :param max_distance: the maximum distance along the ray to consider, unlimited if None
+        :param mask: optional filter bitmask over the meshlist indices, see util.maya.mesh_filter
+        :param use_cull: only consider what is visible in the frustum passed to cull(). Off by default such that e.g.
+                         occlusion checks are not affected by the last camera the structure was culled against
+
+        :return: A tuple of (mesh name, hit position, distance) or None
+        '''
+        indices = set()
+        for leaf in self._iter_leaves(self._visible_grid if use_cull else self.grid, ray, self._get_max_param(ray, max_distance)):
+            indices.update(index for index in leaf if mesh_filter.is_eligible(mask, index))
+        return self._closest_hit_among(meshes, ray, indices, max_distance)
+
+    @timer.timer_decorator
+    def any_hit(self, meshes: meshlist.MFnMeshList, ray: ray.Ray, max_distance: float = None, mask: int = None, use_cull: bool = False):
+        '''
+        Check whether the ray hits any mesh within max_distance, returning as soon as the first hit is found
+
+        :param meshes: the meshlist of the whole scene to iterate over
+        :param max_distance: the maximum distance along the ray to consider, unlimited if None
+        :param mask: optional filter bitmask over the meshlist indices, see util.maya.mesh_filter
+        :param use_cull: only consider what is visible in the frustum passed to cull(). Off by default such that e.g.
+                         occlusion checks are not affected by the last camera the structure was culled against
+
+        :return: The mesh name of the first found hit and the hit position or None
+        '''
+        # Convert to MFloatPoint ahead of time to avoid doing it for every mesh iteration
+        ray_origin = om.MFloatPoint(ray.origin)
+        ray_direction = om.MFloatVector(ray.direction)
+        max_param = self._get_max_param(ray, max_distance)
+
+        tested = set()      # Meshes overlapping multiple leaves only need to be tested once
+        for leaf in self._iter_leaves(self._visible_grid if use_cull else self.grid, ray, max_param):
+            for index in leaf:
+                if index in tested or not mesh_filter.is_eligible(mask, index):
+                    continue
+                tested.add(index)
+                intersection_point = meshes.mfn_meshes[index].anyIntersection(ray_origin,              # raySource
+                                                                              ray_direction,           # rayDirection
+                                                                              om.MSpace.kWorld,        # space
+                                                                              max_param,               # maxParam
+                                                                              False)                   # testBothDirections
+                if intersection_point:
+                    return (meshes.get_name_at_index(index), intersection_point[0])
+        return None
+
+    @timer.timer_decorator
+    def all_hits(self, meshes: meshlist.MFnMeshList, ray: ray.Ray, max_distance: float = None, limit: int = None, mask: int = None, use_cull: bool = False):
+        '''
+        Get the closest hit of every mesh the ray passes through within max_distance, ordered by distance
+
+        :param meshes: the meshlist of the whole scene to iterate over
+        :param max_distance: the maximum distance along the ray to consider, unlimited if None
+        :param limit: the maximum amount of hits to return, all hits if None
+        :param mask: optional filter bitmask over the meshlist indices, see util.maya.mesh_filter
+        :param use_cull: only consider what is visible in the frustum passed to cull(). Off by default such that e.g.
+                         occlusion checks are not affected by the last camera the structure was culled against
+
+        :return: A list of (mesh name, hit position, distance) tuples sorted by distance
+        '''
+        # Convert to MFloatPoint ahead of time to avoid doing it for every mesh iteration
+        ray_origin = om.MFloatPoint(ray.origin)
+        ray_direction = om.MFloatVector(ray.direction)
+        max_param = self._get_max_param(ray, max_distance)
+
+        hits = []
+        tested = set()      # Meshes overlapping multiple leaves only need to be tested once
+        for leaf in self._iter_leaves(self._visible_grid if use_cull else self.grid, ray, max_param):
+            for index in leaf:
+                if index in tested or not mesh_filter.is_eligible(mask, index):
+                    continue
+                tested.add(index)
+                intersection_point = meshes.mfn_meshes[index].closestIntersection(ray_origin,              # raySource
+                                                                                  ray_direction,           # rayDirection
+                                                                                  om.MSpace.kWorld,        # space
+                                                                                  max_param,               # maxParam
+                                                                                  False)                   # testBothDirections
+                if intersection_point:
+                    hits.append((meshes.get_name_at_index(index), intersection_point[0], ray_origin.distanceTo(intersection_point[0])))
+
+        hits.sort(key=lambda hit: hit[2])
+        if limit is not None:
+            return hits[:limit]
+        return hits
@@ -0,0 +1,271 @@
+'''
+Batch raycasting for scripted pipelines. Rather than answering a single mouse-click, a BatchRaycaster casts any number
+of rays against a cached acceleration structure and returns the hits as flat arrays which are cheap to pass around
+'''
+import array
+import math
+import multiprocessing
+import os
+import sys
+import time
+
+import maya.api.OpenMaya as om
+
+import GetClosestIntersection.core.project_to_3d as project_to_3d
+import GetClosestIntersection.core.shared_bvh as shared_bvh
+import GetClosestIntersection.core.acceleration_structures as acceleration_structures
+import GetClosestIntersection.core.ray as ray
+
+import GetClosestIntersection.util.maya.meshlist as meshlist
+import GetClosestIntersection.util.timer as timer
+
+# Amount of values stored per ray in the flat result array: [x, y, z, distance, mesh_index]
+RESULT_STRIDE = shared_bvh.RESULT_STRIDE
+
+# Distance and mesh index written to the result array for rays which did not hit anything
+NO_HIT = shared_bvh.NO_HIT
+
+
+def _configure_executable():
+    '''
+    Inside of an interactive Maya session sys.executable points to the Maya binary itself (e.g. maya.bin on Linux) which
+    can not be used to spawn worker processes, point multiprocessing at the mayapy interpreter of the installation instead
+    '''
+    executable = os.path.basename(sys.executable).lower()
+    if not executable.startswith("maya") or executable.startswith("mayapy"):
+        return
+    # MAYA_LOCATION is set by every Maya session, on macOS it points at Maya.app/Contents rather than the binary's folder
+    maya_location = os.environ.get("MAYA_LOCATION", os.path.dirname(os.path.dirname(sys.executable)))
+    mayapy = os.path.join(maya_location, "bin", "mayapy.exe" if sys.platform == "win32" else "mayapy")
+    multiprocessing.set_executable(mayapy)
+
+
+class BatchRaycaster():
+    '''
+    Casts batches of rays against the scene, the meshlist and acceleration structure are built once and reused across
+    calls until the meshes in the scene change or another scene is opened. Moving meshes does not invalidate them,
+    call update(force=True) afterwards
+    '''
+
+    def __init__(self, accel_structure_name: str = None):
+        '''
+        :param accel_structure_name: One of {'None', 'Octree', 'BVH', 'Grid'}, defaults to the ACCELERATION_STRUCTURE specified in constants.py
+        '''
+        self._accel_structure_name = accel_structure_name
+        self.meshlist: meshlist.MFnMeshList = None
+        self.accel_structure: acceleration_structures.base.AccelerationStructure = None
+        self._name_to_index: dict[str, int] = {}
+        self._scene_generation: int = None
+
+    def is_stale(self) -> bool:
+        '''
+        Check whether the cached meshlist refers to other meshes than those in the scene. Without the scene callbacks a
+        newly opened scene is only detected once any of the cached meshes were deleted along with the old one
+        '''
+        if self.meshlist is None:
+            return True
+        generation = meshlist.get_scene_generation()
+        if generation is None:
+            if not self.meshlist.is_valid():
+                return True
+        elif generation != self._scene_generation:
+            return True
+        return not self.meshlist == meshlist.get_scene_mesh_names()
+
+    def update(self, force: bool = False):
+        '''
+        Build the meshlist and acceleration structure if they do not exist yet, the meshes in the scene changed or
+        another scene was opened
+
+        :param force: rebuild regardless of whether the cached structures are stale, e.g. after meshes were moved
+        '''
+        if not force and not self.is_stale():
+            return
+        scoped_timer = timer.ScopedTimer("Building the MeshList and Acceleration Structure for batch raycasting")
+        self._scene_generation = meshlist.get_scene_generation()
+        self.meshlist = meshlist.MFnMeshList.from_scene()
+        self.accel_structure = acceleration_structures.create_acceleration_structure(self.meshlist, self._accel_structure_name)
+        self._name_to_index = {self.meshlist.get_name_at_index(i): i for i in range(len(self.meshlist))}
+
+    @property
+    def mesh_names(self) -> list[str]:
+        '''
+        The names of the meshes the mesh indices in the result arrays refer to
+        '''
+        if self.meshlist is None:
+            return []
+        return [self.meshlist.get_name_at_index(i) for i in range(len(self.meshlist))]
+
+    @timer.timer_decorator
+    def raycast(self, origins: list[float], directions: list[float], max_distance: float = None) -> list[float]:
+        '''
+        Cast one ray per origin/direction pair and find its closest intersection
+
+        :param origins: the flat world space ray origins as [x0, y0, z0, x1, y1, z1, ...]
+        :param directions: the flat world space ray directions in the same layout as origins
+
+        :return: A flat list of RESULT_STRIDE values per ray, [x, y, z, distance, mesh_index] where distance and
+                 mesh_index are NO_HIT if the ray did not hit anything
+        '''
+        if len(origins) != len(directions) or len(origins) % 3 != 0:
+            om.MGlobal.displayError("Origins and directions must both contain 3 values per ray")
+            return []
+        rays = [ray.Ray(origins[i:i+3], directions[i:i+3]) for i in range(0, len(origins), 3)]
+        return self._cast(rays, max_distance)
+
+    @timer.timer_decorator
+    def raycast_from_camera(self, camera: str, screen_coords: list[float], max_distance: float = None) -> list[float]:
+        '''
+        Cast one ray per screen space coordinate through the given camera and find its closest intersection
+
+        :param camera: the name of the camera (transform or shape) to cast from
+        :param screen_coords: the flat normalized screen space coordinates as [u0, v0, u1, v1, ...]
+
+        :return: A flat list of RESULT_STRIDE values per ray, see raycast()
+        '''
+        if len(screen_coords) % 2 != 0:
+            om.MGlobal.displayError("Screen coordinates must contain 2 values per ray")
+            return []
+        selection_list = om.MSelectionList()
+        try:
+            selection_list.add(camera)
+        except RuntimeError:
+            om.MGlobal.displayError(f"'{camera}' does not exist")
+            return []
+        camera_path = selection_list.getDagPath(0)
+        if not camera_path.hasFn(om.MFn.kCamera):
+            om.MGlobal.displayError(f"'{camera}' is not a camera")
+            return []
+        if camera_path.apiType() != om.MFn.kCamera:
+            camera_path.extendToShape()
+        camera_fn = om.MFnCamera(camera_path)
+
+        rays = [project_to_3d.project_camera_to_3d(camera_fn, screen_coords[i:i+2]) for i in range(0, len(screen_coords), 2)]
+        return self._cast(rays, max_distance)
+
+    def _cast(self, rays: list[ray.Ray], max_distance: float = None) -> list[float]:
+        self.update()
+
+        # Preallocate the result, assuming a miss for every ray. All values are floats such that setResult() always
+        # returns a double array
+        result = [0.0, 0.0, 0.0, float(NO_HIT), float(NO_HIT)] * len(rays)
+        for i, cast_ray in enumerate(rays):
+            hit = self.accel_structure.closest_hit(self.meshlist, cast_ray, max_distance)
+            if not hit:
+                continue
+            name, point, distance = hit
+            offset = i * RESULT_STRIDE
+            result[offset] = float(point[0])
+            result[offset+1] = float(point[1])
+            result[offset+2] = float(point[2])
+            result[offset+3] = float(distance)
+            result[offset+4] = float(self._name_to_index[name])
+        return result
+
+    @timer.timer_decorator
+    def parallel_raycast(self, origins: list[float], directions: list[float], processes: int = None, max_distance: float = None,
+                         chunk_size: int = None) -> list[float]:
+        '''
+        Same as raycast() but splits the rays across a pool of worker processes. The BVH and the world space triangles
+        of the meshes are published once into shared memory and attached zero-copy by every worker, which then runs both
+        the traversal and the triangle intersections for its chunk of rays and only returns the final hits. The workers
+        never initialize Maya or load the scene. Requires the BVH acceleration structure.
+
+        :param processes: the amount of worker processes, defaults to the cpu count
+        :param chunk_size: the amount of rays handed to a worker at once, defaults to a quarter of each worker's share
+
+        :return: A flat list of RESULT_STRIDE values per ray, see raycast()
+        '''
+        if len(origins) != len(directions) or len(origins) % 3 != 0:
+            om.MGlobal.displayError("Origins and directions must both contain 3 values per ray")
+            return []
+        self.update()
+        if not isinstance(self.accel_structure, acceleration_structures.BVH):
+            om.MGlobal.displayError("parallel_raycast is only supported for the 'BVH' acceleration structure")
+            return []
+
+        processes = processes or os.cpu_count()
+        chunks = self._split_rays(origins, directions, max_distance, processes, chunk_size)
+        _configure_executable()
+        shared = self._publish()
+        try:
+            with self._create_pool(processes, shared) as pool:
+                result = []
+                for chunk_result in pool.map(shared_bvh.raycast_chunk, chunks):
+                    result.extend(chunk_result)
+                return result
+        finally:
+            for block in shared:
+                block.close()
+                block.unlink()
+
+    def _split_rays(self, origins: list[float], directions: list[float], max_distance: float, processes: int, chunk_size: int = None) -> list[tuple]:
+        '''
+        Split the rays into the chunks handed to the workers as (origins, directions, max_distance) with flat arrays
+        '''
+        origins = array.array('d', origins)
+        directions = array.array('d', directions)
+        if chunk_size is None:
+            # Several chunks per worker such that a worker which got the more expensive rays does not hold up the others
+            chunk_size = max(1, math.ceil(len(origins) // 3 / (processes * 4)))
+        return [(origins[i:i + chunk_size * 3], directions[i:i + chunk_size * 3], max_distance) for i in range(0, len(origins), chunk_size * 3)]
+
+    def _publish(self) -> tuple[shared_bvh.SharedBVH, shared_bvh.SharedMeshes]:
+        '''
+        Publish the BVH and the meshes into shared memory, the caller must close and unlink both blocks once done
+        '''
+        shared = shared_bvh.SharedBVH.publish(self.accel_structure)
+        try:
+            return shared, shared_bvh.SharedMeshes.publish(self.meshlist)
+        except Exception:
+            shared.close()
+            shared.unlink()
+            raise
+
+    def _create_pool(self, processes: int, shared: tuple, barrier = None):
+        # Always spawn, forking would duplicate the whole interactive Maya session into every worker
+        context = multiprocessing.get_context("spawn")
+        return context.Pool(processes, initializer=shared_bvh.init_worker, initargs=(shared[0].name, shared[1].name, barrier))
+
+    def benchmark_parallel_scaling(self, origins: list[float], directions: list[float], process_counts = (1, 2, 4, 8, 12, 16, 20, 24),
+                                   max_distance: float = None, chunk_size: int = None) -> dict:
+        '''
+        Time parallel_raycast() across different amounts of worker processes and report the scaling efficiency, i.e. the
+        speedup over a single process divided by the amount of processes. The shared memory is published once and every
+        pool is created once per process count, only the raycast itself is timed after all workers started and attached.
+        A single process is always measured as the baseline
+
+        :return: A dict mapping the process count to a tuple of (time in ms, speedup, efficiency)
+        '''
+        if len(origins) != len(directions) or len(origins) % 3 != 0:
+            om.MGlobal.displayError("Origins and directions must both contain 3 values per ray")
+            return {}
+        self.update()
+        if not isinstance(self.accel_structure, acceleration_structures.BVH):
+            om.MGlobal.displayError("benchmark_parallel_scaling is only supported for the 'BVH' acceleration structure")
+            return {}
+
+        _configure_executable()
+        shared = self._publish()
+        report = {}
+        base_time = None
+        try:
+            for processes in sorted(set(process_counts) | {1}):
+                chunks = self._split_rays(origins, directions, max_distance, processes, chunk_size)
+                barrier = multiprocessing.get_context("spawn").Barrier(processes)
+                with self._create_pool(processes, shared, barrier) as pool:
+                    # Exclude the worker startup from the measurement
+                    pool.map(shared_bvh.wait_for_workers, range(processes), chunksize=1)
+                    start = time.perf_counter()
+                    pool.map(shared_bvh.raycast_chunk, chunks)
+                    elapsed = (time.perf_counter() - start) * 1000
+                if base_time is None:
+                    base_time = elapsed
+                speedup = base_time / elapsed
+                report[processes] = (elapsed, speedup, speedup / processes)
+                om.MGlobal.displayInfo(f"parallel_raycast with {processes} processes took {elapsed:.3f} ms, speedup {speedup:.2f}x, efficiency {speedup / processes * 100:.1f}%")
+        finally:
+            for block in shared:
+                block.close()
+                block.unlink()
+        return report
@@ -0,0 +1,103 @@
+import maya.api.OpenMaya as om
+import maya.api.OpenMayaUI as omui
+
+import GetClosestIntersection.util.timer as timer
+
+# Classification results for Frustum.classify_bbox
+OUTSIDE = 0
+INTERSECTS = 1
+INSIDE = 2
+
+
+class Frustum():
+    '''
+    View frustum described by its 8 corner points and the 6 inward facing planes built from them. Used to cull
+    everything that cannot be hit by a ray cast from the view it was constructed from
+    '''
+
+    def __init__(self, near_points: list[om.MPoint], far_points: list[om.MPoint]) -> None:
+        '''
+        :param near_points: the 4 corners on the near clip plane ordered bottom-left, bottom-right, top-right, top-left
+        :param far_points: the 4 corners on the far clip plane in the same order as near_points
+        '''
+        assert len(near_points) == 4
+        assert len(far_points) == 4
+        self.near_points = near_points
+        self.far_points = far_points
+
+        center = om.MVector()
+        for point in near_points + far_points:
+            center = center + om.MVector(point)
+        center = center / 8.0
+
+        n = near_points
+        f = far_points
+        # Each plane is defined by 3 of its corner points, the winding does not matter as the normals get flipped
+        # to face the center of the frustum
+        self.planes: list[tuple[om.MVector, float]] = [
+            self._make_plane(n[0], n[1], n[2], center),     # near
+            self._make_plane(f[0], f[1], f[2], center),     # far
+            self._make_plane(n[0], n[3], f[0], center),     # left
+            self._make_plane(n[1], n[2], f[1], center),     # right
+            self._make_plane(n[0], n[1], f[0], center),     # bottom
+            self._make_plane(n[3], n[2], f[3], center),     # top
+        ]
+
+    @classmethod
+    @timer.timer_decorator
+    def from_view(cls, view: omui.M3dView):
+        '''
+        Construct the frustum of a given view by projecting the corners of its viewport onto the near and far clip planes
+        '''
+        width = view.portWidth()
+        height = view.portHeight()
+        near_points = []
+        far_points = []
+        for x, y in ((0, 0), (width, 0), (width, height), (0, height)):
+            near_point = om.MPoint()
+            far_point = om.MPoint()
+            # Similar to project_to_3d the points get modified in-place by the viewToWorld function
+            view.viewToWorld(x, y, near_point, far_point)
+            near_points.append(near_point)
+            far_points.append(far_point)
+        return cls(near_points, far_points)
+
+    def _make_plane(self, a: om.MPoint, b: om.MPoint, c: om.MPoint, center: om.MVector) -> tuple[om.MVector, float]:
+        normal = ((b - a) ^ (c - a)).normal()
+        distance = -(normal * om.MVector(a))
+        # Flip the plane so that the inside of the frustum lies on its positive side
+        if normal * center + distance < 0:
+            normal = -normal
+            distance = -distance
+        return (normal, distance)
+
+    def classify_bbox(self, bbox: om.MBoundingBox) -> int:
+        '''
+        Classify a bounding box against the frustum, this is conservative meaning a box which is classified as
+        INTERSECTS may in rare cases still lie outside of the frustum
+
+        :return: One of OUTSIDE, INTERSECTS or INSIDE
+        '''
+        bbox_min = bbox.min
+        bbox_max = bbox.max
+        result = INSIDE
+        for normal, distance in self.planes:
+            # The corner furthest along the plane normal (p) and the one furthest against it (n)
+            p = [bbox_max[i] if normal[i] >= 0 else bbox_min[i] for i in range(3)]
+            n = [bbox_min[i] if normal[i] >= 0 else bbox_max[i] for i in range(3)]
+            if normal[0] * p[0] + normal[1] * p[1] + normal[2] * p[2] + distance < 0:
+                return OUTSIDE
+            if normal[0] * n[0] + normal[1] * n[1] + normal[2] * n[2] + distance < 0:
+                result = INTERSECTS
+        return result
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Frustum):
+            return False
+        for a, b in zip(self.near_points + self.far_points, other.near_points + other.far_points):
+            if not a.isEquivalent(b):
+                return False
+        return True
+
+    def __ne__(self, other) -> bool:
+        return not self.__eq__(other)
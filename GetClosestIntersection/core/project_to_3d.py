@@ -1,3 +1,5 @@
+import math
+
 import maya.api.OpenMaya as om
 import maya.api.OpenMayaUI as omui
 
@@ -25,3 +27,36 @@ def project_to_3d(screen_space_coords) -> ray.Ray:
     )
     return projection_ray
 
+
+def project_camera_to_3d(camera: om.MFnCamera, screen_space_coords) -> ray.Ray:
+    '''
+    Project a normalized 2d screen space coordinate of a camera to a 3d Ray in the format {origin, direction}. Unlike
+    project_to_3d this does not require a viewport and can therefore be used in headless sessions such as mayapy
+
+    :param camera: the function set of the camera to project from, must be attached to a dag path
+    :param screen_space_coords: the coordinates within the camera's film gate ranging from (0, 0) bottom-left to (1, 1) top-right
+
+    :returns: the projected ray
+    :rtype: ray.Ray()
+    '''
+    # Remap from [0, 1] to [-1, 1] with the center of the screen at 0
+    x = screen_space_coords[0] * 2.0 - 1.0
+    y = screen_space_coords[1] * 2.0 - 1.0
+
+    eye_point = camera.eyePoint(om.MSpace.kWorld)
+    view_direction = camera.viewDirection(om.MSpace.kWorld)
+    up_direction = camera.upDirection(om.MSpace.kWorld)
+    right_direction = camera.rightDirection(om.MSpace.kWorld)
+
+    projection_ray = ray.Ray()
+    if camera.isOrtho():
+        half_width = camera.orthoWidth() / 2.0
+        half_height = half_width / camera.aspectRatio()
+        projection_ray.origin = eye_point + right_direction * (x * half_width) + up_direction * (y * half_height)
+        projection_ray.direction = view_direction
+    else:
+        projection_ray.origin = eye_point
+        projection_ray.direction = (view_direction
+                                    + right_direction * (x * math.tan(camera.horizontalFieldOfView() / 2.0))
+                                    + up_direction * (y * math.tan(camera.verticalFieldOfView() / 2.0))).normal()
+    return projection_ray
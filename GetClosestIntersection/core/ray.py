@@ -44,6 +44,41 @@ class Ray():
         
         return True
     
+    def intersect_bbox_range(self, bbox: om.MBoundingBox) -> tuple[float, float]:
+        '''
+        Compute the ray parameters at which the ray enters and exits a bounding box. Unlike intersect_bbox this handles
+        rays running parallel to one of the axes
+
+        :return: A tuple of (t_enter, t_exit) with t_enter clamped to 0 or None if the ray misses the bounding box
+        '''
+        t_enter = 0.0
+        t_exit = float('inf')
+        for axis in range(3):
+            if self.direction[axis] == 0:
+                # A parallel ray can only hit the box if its origin lies within the slab
+                if self.origin[axis] < bbox.min[axis] or self.origin[axis] > bbox.max[axis]:
+                    return None
+                continue
+            t_min = (bbox.min[axis] - self.origin[axis]) / self.direction[axis]
+            t_max = (bbox.max[axis] - self.origin[axis]) / self.direction[axis]
+            if t_min > t_max:
+                t_min, t_max = t_max, t_min
+            t_enter = max(t_enter, t_min)
+            t_exit = min(t_exit, t_max)
+            if t_enter > t_exit:
+                return None
+        return (t_enter, t_exit)
+
+    def param_at_distance(self, distance: float) -> float:
+        '''
+        Convert a world space distance along the ray into a ray parameter, taking non-normalized directions into account
+        '''
+        length = self.direction.length()
+        if length == 0:
+            # A ray without a direction can not travel any distance
+            return 0.0
+        return distance / length
+
     def closest_bbox(self, bbox_list: list[om.MBoundingBox]) -> om.MBoundingBox:
         min_distance = float('inf')
         closest_bbox = None
@@ -0,0 +1,369 @@
+'''
+Flattened, read-only BVH and mesh triangles published into shared memory so a pool of worker processes can run both
+the traversal and the triangle intersections zero-copy, rather than every process rebuilding the meshlist and BVH or
+loading the scene itself.
+
+This module deliberately does not import maya at the top level, the workers therefore do not need to initialize Maya
+at all. Only flattening the meshes in the publishing process requires it.
+
+Shared memory layout of the BVH, all values are 8 bytes wide:
+    header:  [node_count, index_count]
+    bounds:  node_count * [min_x, min_y, min_z, max_x, max_y, max_z]
+    nodes:   node_count * [left, right, is_leaf], for leaves left/right hold the offset/count into the index buffer
+    indices: index_count * [meshlist_index]
+
+Shared memory layout of the meshes, all values are 8 bytes wide:
+    header:    [mesh_count, triangle_count]
+    bounds:    mesh_count * [min_x, min_y, min_z, max_x, max_y, max_z]
+    ranges:    mesh_count * [first_triangle, triangle_count]
+    triangles: triangle_count * [x0, y0, z0, x1, y1, z1, x2, y2, z2] in world space
+'''
+import array
+import math
+from multiprocessing import shared_memory
+
+# Layout of the raycast results, [x, y, z, distance, mesh_index] per ray with distance and mesh_index set to NO_HIT on a miss
+RESULT_STRIDE = 5
+NO_HIT = -1
+
+HEADER_SIZE = 2
+NODE_STRIDE = 3
+BOUNDS_STRIDE = 6
+RANGE_STRIDE = 2
+TRIANGLE_STRIDE = 9
+ITEM_SIZE = 8
+
+
+def flatten_bvh(bvh) -> tuple[array.array, array.array, array.array]:
+    '''
+    Flatten a BVH into three compact arrays in pre-order with the root at index 0
+
+    :return: A tuple of (bounds, nodes, indices) laid out as described in the module docstring
+    '''
+    bounds = array.array('d')
+    nodes = array.array('q')
+    indices = array.array('q')
+
+    stack = [(bvh.root, -1, 0)]     # (node, parent id, slot in the parent, 0 for left and 1 for right)
+    while stack:
+        node, parent, slot = stack.pop()
+        node_id = len(nodes) // NODE_STRIDE
+        if parent >= 0:
+            nodes[parent * NODE_STRIDE + slot] = node_id
+
+        bounds.extend((node.bbox.min[0], node.bbox.min[1], node.bbox.min[2], node.bbox.max[0], node.bbox.max[1], node.bbox.max[2]))
+        if node.indices is not None:
+            nodes.extend((len(indices), len(node.indices), 1))
+            indices.extend(node.indices)
+            continue
+
+        nodes.extend((-1, -1, 0))
+        stack.append((node.right, node_id, 1))
+        stack.append((node.left, node_id, 0))
+    return bounds, nodes, indices
+
+
+def flatten_meshes(meshlist) -> tuple[array.array, array.array, array.array]:
+    '''
+    Flatten the world space triangles of every mesh in a meshlist, indexed the same way as the meshlist
+
+    :return: A tuple of (bounds, ranges, triangles) laid out as described in the module docstring
+    '''
+    import maya.api.OpenMaya as om
+
+    bounds = array.array('d')
+    ranges = array.array('q')
+    triangles = array.array('d')
+    for index in range(len(meshlist)):
+        bbox = meshlist.get_bbox_at_index(index)
+        bounds.extend((bbox.min[0], bbox.min[1], bbox.min[2], bbox.max[0], bbox.max[1], bbox.max[2]))
+
+        mfn_mesh = meshlist.mfn_meshes[index]
+        points = mfn_mesh.getPoints(om.MSpace.kWorld)
+        _, vertices = mfn_mesh.getTriangles()
+        ranges.extend((len(triangles) // TRIANGLE_STRIDE, len(vertices) // 3))
+        for vertex in vertices:
+            point = points[vertex]
+            triangles.extend((point[0], point[1], point[2]))
+    return bounds, ranges, triangles
+
+
+def _intersect_bounds(bounds, base: int, origin: tuple, inv_direction: tuple, max_param: float) -> float:
+    '''
+    Slab test of a ray against the box stored at bounds[base:base + BOUNDS_STRIDE]
+
+    :return: The ray parameter at which the ray enters the box or None if it is missed
+    '''
+    t_enter = 0.0
+    t_exit = max_param
+    for axis in range(3):
+        bbox_min = bounds[base + axis]
+        bbox_max = bounds[base + 3 + axis]
+        if inv_direction[axis] is None:
+            # A parallel ray can only hit the box if its origin lies within the slab
+            if origin[axis] < bbox_min or origin[axis] > bbox_max:
+                return None
+            continue
+        t_min = (bbox_min - origin[axis]) * inv_direction[axis]
+        t_max = (bbox_max - origin[axis]) * inv_direction[axis]
+        if t_min > t_max:
+            t_min, t_max = t_max, t_min
+        t_enter = max(t_enter, t_min)
+        t_exit = min(t_exit, t_max)
+        if t_enter > t_exit:
+            return None
+    return t_enter
+
+
+def _inverse_direction(direction: tuple) -> tuple:
+    return tuple(1.0 / d if d != 0 else None for d in direction)
+
+
+class SharedArrays():
+    '''
+    Base for read-only arrays stored in a single multiprocessing.shared_memory block, prefixed by a header of
+    HEADER_SIZE counts. Subclasses define the layout by splitting the block into views in _create_views
+    '''
+
+    def __init__(self, shm: shared_memory.SharedMemory):
+        self._shm = shm
+        header = shm.buf[:HEADER_SIZE * ITEM_SIZE].cast('q')
+        counts = tuple(header)
+        header.release()
+        self._views = self._create_views(counts)
+
+    def _create_views(self, counts: tuple) -> list[memoryview]:
+        raise NotImplementedError
+
+    def _cast_views(self, layout: list[tuple[int, str]]) -> list[memoryview]:
+        '''
+        Split the block following the header into consecutive views
+
+        :param layout: a list of (value count, array typecode) per view
+        '''
+        views = []
+        offset = HEADER_SIZE * ITEM_SIZE
+        for count, typecode in layout:
+            views.append(self._shm.buf[offset:offset + count * ITEM_SIZE].cast(typecode))
+            offset = offset + count * ITEM_SIZE
+        return views
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    @classmethod
+    def _publish(cls, counts: tuple, arrays: list[array.array]):
+        '''
+        Copy the header counts and the arrays into a newly created shared memory block. The publishing process owns the
+        block and must call unlink() once all workers are done
+        '''
+        size = (HEADER_SIZE + sum(len(values) for values in arrays)) * ITEM_SIZE
+        shm = shared_memory.SharedMemory(create=True, size=size)
+
+        offset = 0
+        for values in [array.array('q', counts)] + arrays:
+            data = values.tobytes()
+            shm.buf[offset:offset + len(data)] = data
+            offset = offset + len(data)
+        return cls(shm)
+
+    @classmethod
+    def attach(cls, name: str):
+        '''
+        Attach to a shared memory block previously created by publish() without copying it
+        '''
+        return cls(shared_memory.SharedMemory(name=name))
+
+    def close(self):
+        for view in self._views:
+            view.release()
+        self._views = []
+        self._shm.close()
+
+    def __del__(self):
+        # The views have to be released before the shared memory gets garbage collected, otherwise closing it fails
+        self.close()
+
+    def unlink(self):
+        self._shm.unlink()
+
+
+class SharedBVH(SharedArrays):
+    '''
+    View onto a flattened BVH stored in a multiprocessing.shared_memory block
+    '''
+
+    def _create_views(self, counts: tuple) -> list[memoryview]:
+        self.node_count, self.index_count = counts
+        views = self._cast_views([(self.node_count * BOUNDS_STRIDE, 'd'), (self.node_count * NODE_STRIDE, 'q'), (self.index_count, 'q')])
+        self.bounds, self.nodes, self.indices = views
+        return views
+
+    @classmethod
+    def publish(cls, bvh):
+        '''
+        Flatten the BVH and copy it into a newly created shared memory block
+        '''
+        bounds, nodes, indices = flatten_bvh(bvh)
+        return cls._publish((len(nodes) // NODE_STRIDE, len(indices)), [bounds, nodes, indices])
+
+    def find_candidates(self, origin: tuple, direction: tuple, max_param: float) -> list[tuple[float, int]]:
+        '''
+        Find all meshes in the leaves hit by the ray
+
+        :return: A list of (t_enter, meshlist_index) sorted by the ray parameter at which the ray enters the mesh's leaf
+        '''
+        if self.node_count == 0:
+            return []
+        inv_direction = _inverse_direction(direction)
+        candidates = []
+        stack = [0]
+        while stack:
+            node_id = stack.pop()
+            t_enter = _intersect_bounds(self.bounds, node_id * BOUNDS_STRIDE, origin, inv_direction, max_param)
+            if t_enter is None:
+                continue
+            base = node_id * NODE_STRIDE
+            if self.nodes[base + 2]:
+                start = self.nodes[base]
+                for i in range(start, start + self.nodes[base + 1]):
+                    candidates.append((t_enter, self.indices[i]))
+                continue
+            stack.append(self.nodes[base + 1])
+            stack.append(self.nodes[base])
+        candidates.sort()
+        return candidates
+
+
+class SharedMeshes(SharedArrays):
+    '''
+    View onto the flattened world space triangles of a meshlist stored in a multiprocessing.shared_memory block
+    '''
+
+    def _create_views(self, counts: tuple) -> list[memoryview]:
+        self.mesh_count, self.triangle_count = counts
+        views = self._cast_views([(self.mesh_count * BOUNDS_STRIDE, 'd'), (self.mesh_count * RANGE_STRIDE, 'q'), (self.triangle_count * TRIANGLE_STRIDE, 'd')])
+        self.bounds, self.ranges, self.triangles = views
+        return views
+
+    @classmethod
+    def publish(cls, meshlist):
+        '''
+        Flatten the triangles of the meshlist and copy them into a newly created shared memory block
+        '''
+        bounds, ranges, triangles = flatten_meshes(meshlist)
+        return cls._publish((len(ranges) // RANGE_STRIDE, len(triangles) // TRIANGLE_STRIDE), [bounds, ranges, triangles])
+
+    def intersect(self, index: int, origin: tuple, direction: tuple, inv_direction: tuple, max_param: float) -> float:
+        '''
+        Find the closest intersection of a ray with the triangles of a mesh using the Moller-Trumbore test, both sides of
+        a triangle count as a hit just like for MFnMesh.closestIntersection
+
+        :return: The ray parameter of the closest hit below max_param or None
+        '''
+        if _intersect_bounds(self.bounds, index * BOUNDS_STRIDE, origin, inv_direction, max_param) is None:
+            return None
+        ox, oy, oz = origin
+        dx, dy, dz = direction
+        triangles = self.triangles
+        best_param = None
+        start = self.ranges[index * RANGE_STRIDE] * TRIANGLE_STRIDE
+        end = start + self.ranges[index * RANGE_STRIDE + 1] * TRIANGLE_STRIDE
+        for base in range(start, end, TRIANGLE_STRIDE):
+            x0, y0, z0, x1, y1, z1, x2, y2, z2 = triangles[base:base + TRIANGLE_STRIDE]
+            e1x, e1y, e1z = x1 - x0, y1 - y0, z1 - z0
+            e2x, e2y, e2z = x2 - x0, y2 - y0, z2 - z0
+            px, py, pz = dy * e2z - dz * e2y, dz * e2x - dx * e2z, dx * e2y - dy * e2x
+            det = e1x * px + e1y * py + e1z * pz
+            if -1e-12 < det < 1e-12:
+                # The ray runs parallel to the triangle
+                continue
+            inv_det = 1.0 / det
+            sx, sy, sz = ox - x0, oy - y0, oz - z0
+            u = (sx * px + sy * py + sz * pz) * inv_det
+            if u < 0.0 or u > 1.0:
+                continue
+            qx, qy, qz = sy * e1z - sz * e1y, sz * e1x - sx * e1z, sx * e1y - sy * e1x
+            v = (dx * qx + dy * qy + dz * qz) * inv_det
+            if v < 0.0 or u + v > 1.0:
+                continue
+            param = (e2x * qx + e2y * qy + e2z * qz) * inv_det
+            if 0.0 <= param < max_param:
+                max_param = param
+                best_param = param
+        return best_param
+
+
+def get_max_param(direction: tuple, max_distance: float = None) -> float:
+    '''
+    Convert a world space distance along a ray into a ray parameter, see ray.Ray.param_at_distance
+    '''
+    if max_distance is None:
+        return 9999999
+    length = math.sqrt(direction[0] ** 2 + direction[1] ** 2 + direction[2] ** 2)
+    if length == 0:
+        # A ray without a direction can not travel any distance
+        return 0.0
+    return max_distance / length
+
+
+# State of the current worker process, set up once per worker by init_worker
+_worker_state = {}
+
+
+def init_worker(bvh_name: str, meshes_name: str, barrier = None):
+    '''
+    Pool initializer attaching the worker to the published BVH and meshes
+
+    :param barrier: optional multiprocessing.Barrier shared by all workers of the pool, see wait_for_workers
+    '''
+    _worker_state["bvh"] = SharedBVH.attach(bvh_name)
+    _worker_state["meshes"] = SharedMeshes.attach(meshes_name)
+    _worker_state["barrier"] = barrier
+
+
+def wait_for_workers(_ = None):
+    '''
+    Block until every worker of the pool runs this task, mapping it once per worker with a chunksize of 1 guarantees
+    that all workers started and attached to the shared memory
+    '''
+    _worker_state["barrier"].wait()
+
+
+def raycast_chunk(args: tuple) -> array.array:
+    '''
+    Find the closest intersection for a chunk of rays
+
+    :param args: a tuple of (origins, directions, max_distance) with origins and directions as flat arrays of 3 values per ray
+
+    :return: A flat array of RESULT_STRIDE values per ray
+    '''
+    origins, directions, max_distance = args
+    shared_bvh = _worker_state["bvh"]
+    shared_meshes = _worker_state["meshes"]
+    result = array.array('d', [0.0, 0.0, 0.0, NO_HIT, NO_HIT]) * (len(origins) // 3)
+    for i in range(0, len(origins), 3):
+        origin = (origins[i], origins[i+1], origins[i+2])
+        direction = (directions[i], directions[i+1], directions[i+2])
+        inv_direction = _inverse_direction(direction)
+
+        best_param = get_max_param(direction, max_distance)
+        best_index = NO_HIT
+        for t_enter, index in shared_bvh.find_candidates(origin, direction, best_param):
+            # Candidates are sorted by their leaf entry, no later leaf can contain a closer hit
+            if t_enter > best_param:
+                break
+            param = shared_meshes.intersect(index, origin, direction, inv_direction, best_param)
+            if param is not None:
+                best_param = param
+                best_index = index
+
+        if best_index != NO_HIT:
+            offset = (i // 3) * RESULT_STRIDE
+            result[offset] = origin[0] + direction[0] * best_param
+            result[offset+1] = origin[1] + direction[1] * best_param
+            result[offset+2] = origin[2] + direction[2] * best_param
+            result[offset+3] = best_param * math.sqrt(direction[0] ** 2 + direction[1] ** 2 + direction[2] ** 2)
+            result[offset+4] = best_index
+    return result
@@ -0,0 +1,34 @@
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    '''
+    Dictionary like cache holding at most `capacity` items, evicting the least recently used item once full
+    '''
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.items = OrderedDict()
+
+    def get(self, key, default = None):
+        if key not in self.items:
+            return default
+        self.items.move_to_end(key)
+        return self.items[key]
+
+    def put(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+        if len(self.items) > self.capacity:
+            self.items.popitem(last=False)
+
+    def values(self):
+        return self.items.values()
+
+    def clear(self):
+        self.items.clear()
+
+    def __contains__(self, key) -> bool:
+        return key in self.items
+
+    def __len__(self) -> int:
+        return len(self.items)
@@ -0,0 +1,91 @@
+'''
+Query filters over the indices of a MFnMeshList. A filter is stored as a bitmask where bit i is set if the mesh at index
+i is eligible, which allows acceleration structures to cheaply prune whole subtrees without any eligible meshes
+'''
+import maya.api.OpenMaya as om
+import maya.cmds as cmds
+
+import GetClosestIntersection.util.maya.meshlist as meshlist
+
+
+def mask_from_indices(indices: list[int]) -> int:
+    '''
+    Build a bitmask from a list of meshlist indices. The bits are gathered in a bytearray as or-ing them into an int one
+    at a time would copy the whole mask for every index
+    '''
+    indices = list(indices)
+    if len(indices) == 0:
+        return 0
+    bits = bytearray((max(indices) >> 3) + 1)
+    for index in indices:
+        bits[index >> 3] |= 1 << (index & 7)
+    return int.from_bytes(bits, "little")
+
+
+def indices_from_mask(mask: int) -> set[int]:
+    '''
+    Get the set of meshlist indices whose bit is set in the mask
+    '''
+    # Reverse the binary representation such that character i corresponds to bit i
+    bits = bin(mask)[:1:-1]
+    return {index for index, bit in enumerate(bits) if bit == "1"}
+
+
+def is_eligible(mask: int, index: int) -> bool:
+    '''
+    Check whether the mesh at index passes the filter, a mask of None lets every mesh pass
+    '''
+    return mask is None or (mask >> index) & 1 == 1
+
+
+def _mask_from_roots(meshes: meshlist.MFnMeshList, root_paths: list[str]) -> int:
+    '''
+    Build a bitmask of all meshes which are either one of the given dag paths or parented underneath one of them
+    '''
+    roots = set(root_paths)
+    indices = []
+    for index, dag_path in enumerate(meshes.mfn_dagpaths):
+        path = dag_path.fullPathName()
+        # Walk up the hierarchy by stripping one path component at a time
+        while path:
+            if path in roots:
+                indices.append(index)
+                break
+            path = path.rpartition("|")[0]
+    return mask_from_indices(indices)
+
+
+def selection_mask(meshes: meshlist.MFnMeshList) -> int:
+    '''
+    Filter to the meshes which are selected or parented underneath a selected transform
+    '''
+    selection_list = om.MGlobal.getActiveSelectionList()
+    root_paths = []
+    for i in range(selection_list.length()):
+        try:
+            root_paths.append(selection_list.getDagPath(i).fullPathName())
+        except Exception:
+            # Non-dag nodes such as materials can be selected as well
+            continue
+    return _mask_from_roots(meshes, root_paths)
+
+
+def display_layer_mask(meshes: meshlist.MFnMeshList, layer: str) -> int:
+    '''
+    Filter to the meshes which are members of the given display layer, either directly or through one of their parents
+    '''
+    members = cmds.editDisplayLayerMembers(layer, query=True, fullNames=True) or []
+    return _mask_from_roots(meshes, members)
+
+
+def namespace_mask(meshes: meshlist.MFnMeshList, namespace: str) -> int:
+    '''
+    Filter to the meshes within the given namespace or any of its nested namespaces
+    '''
+    namespace = namespace.strip(":")
+    indices = []
+    for index, dag_path in enumerate(meshes.mfn_dagpaths):
+        mesh_namespace = om.MFnDependencyNode(dag_path.node()).namespace.strip(":")
+        if mesh_namespace == namespace or mesh_namespace.startswith(namespace + ":"):
+            indices.append(index)
+    return mask_from_indices(indices)
@@ -4,6 +4,189 @@ import maya.cmds as cmds
 import GetClosestIntersection.util.timer as timer
 
 
+# Cached result of get_scene_mesh_names(), only used while the scene callbacks are registered. None if it needs to be recomputed
+_scene_mesh_names: list[str] = None
+
+# Callbacks invalidating the cached mesh names whenever meshes get added, removed, renamed or reparented
+_scene_callback_ids: list[int] = []
+
+# Incremented whenever a new scene is opened or created, only tracked while the scene callbacks are registered
+_scene_generation: int = 0
+
+# Callbacks watching the visibility of every mesh found by the last walk over the DAG and of all of their parents
+_visibility_callback_ids: list[int] = []
+
+# Attributes affecting MDagPath.isVisible() or whether a mesh is an intermediate object, including those of display layers
+_VISIBILITY_ATTRIBUTES = {"visibility", "lodVisibility", "overrideEnabled", "overrideVisibility", "intermediateObject", "enabled"}
+
+
+def _iter_scene_dagpaths(visit = None):
+    '''
+    Walk the DAG once and yield the dag path and function set of every visible, non-intermediate mesh shape
+
+    :param visit: optional function called with the dag path of every mesh shape, including the hidden and intermediate ones
+    '''
+    dag_iter = om.MItDag(om.MItDag.kDepthFirst, om.MFn.kMesh)
+    fn_dag = om.MFnDagNode()
+    while not dag_iter.isDone():
+        dag_path = dag_iter.getPath()
+        dag_iter.next()
+        if visit:
+            visit(dag_path)
+        fn_dag.setObject(dag_path)
+        if fn_dag.isIntermediateObject or not dag_path.isVisible():
+            continue
+        yield dag_path, fn_dag
+
+
+def invalidate_scene_mesh_names(*args):
+    '''
+    Drop the cached mesh names such that the next call to get_scene_mesh_names() walks the DAG again. Takes arbitrary
+    arguments so it can be registered as a callback directly
+    '''
+    global _scene_mesh_names
+    _scene_mesh_names = None
+
+
+def _on_scene_replaced(*args):
+    global _scene_generation
+    _scene_generation += 1
+    invalidate_scene_mesh_names()
+
+
+def _on_attribute_changed(message: int, plug: om.MPlug, other_plug: om.MPlug, client_data):
+    if om.MFnAttribute(plug.attribute()).name in _VISIBILITY_ATTRIBUTES:
+        invalidate_scene_mesh_names()
+
+
+def _remove_callbacks(callback_ids: list[int]):
+    for callback_id in callback_ids:
+        try:
+            om.MMessage.removeCallback(callback_id)
+        except RuntimeError:
+            # The node the callback was registered on does not exist anymore
+            continue
+    callback_ids.clear()
+
+
+def _watch_visibility(dag_path: om.MDagPath, watched: set[int]):
+    '''
+    Register a visibility callback on the mesh and every parent above it which is not already being watched
+    '''
+    path = om.MDagPath(dag_path)
+    while path.length() > 0:
+        node = path.node()
+        handle = om.MObjectHandle(node).hashCode()
+        # Instances share the shape but not necessarily the parents above it, keep walking up past watched nodes
+        if handle not in watched:
+            watched.add(handle)
+            _visibility_callback_ids.append(om.MNodeMessage.addAttributeChangedCallback(node, _on_attribute_changed))
+        path.pop()
+
+
+def _watch_display_layers():
+    '''
+    Register a visibility callback on every display layer, hiding a layer only changes the connected override
+    attributes of its members through the DG which does not trigger their attribute changed callbacks
+    '''
+    layer_iter = om.MItDependencyNodes(om.MFn.kDisplayLayer)
+    while not layer_iter.isDone():
+        _visibility_callback_ids.append(om.MNodeMessage.addAttributeChangedCallback(layer_iter.thisNode(), _on_attribute_changed))
+        layer_iter.next()
+
+
+def add_scene_callbacks():
+    '''
+    Start caching get_scene_mesh_names() by registering callbacks which invalidate the cache on any change to the meshes
+    in the scene. Should be paired with remove_scene_callbacks(), e.g. in initializePlugin and uninitializePlugin
+    '''
+    if _scene_callback_ids:
+        return
+    _scene_callback_ids.extend([
+        om.MDGMessage.addNodeAddedCallback(invalidate_scene_mesh_names, "mesh"),
+        om.MDGMessage.addNodeRemovedCallback(invalidate_scene_mesh_names, "mesh"),
+        om.MDagMessage.addAllDagChangesCallback(invalidate_scene_mesh_names),
+        om.MNodeMessage.addNameChangedCallback(om.MObject.kNullObj, invalidate_scene_mesh_names),
+        om.MSceneMessage.addCallback(om.MSceneMessage.kAfterNew, _on_scene_replaced),
+        om.MSceneMessage.addCallback(om.MSceneMessage.kAfterOpen, _on_scene_replaced),
+    ])
+    invalidate_scene_mesh_names()
+
+
+def remove_scene_callbacks():
+    '''
+    Remove the callbacks registered by add_scene_callbacks(), get_scene_mesh_names() walks the DAG on every call again
+    '''
+    _remove_callbacks(_scene_callback_ids)
+    _remove_callbacks(_visibility_callback_ids)
+    invalidate_scene_mesh_names()
+
+
+def get_scene_generation() -> int:
+    '''
+    Get a counter which is incremented whenever a new scene is opened or created. A MFnMeshList built in an older
+    generation refers to deleted nodes even if the mesh names still match
+
+    :return: The current generation or None if the scene callbacks are not registered
+    '''
+    if not _scene_callback_ids:
+        return None
+    return _scene_generation
+
+
+def get_scene_mesh_names() -> list[str]:
+    '''
+    Return the names of all meshes which iter_scene_meshes() would ingest, this is the cheap counterpart used to check
+    whether a MFnMeshList is stale. While the scene callbacks are registered the names are cached until the meshes in
+    the scene or their visibility change, otherwise the DAG is walked on every call
+    '''
+    global _scene_mesh_names
+    if not _scene_callback_ids:
+        return [dag_path.partialPathName() for dag_path, _ in _iter_scene_dagpaths()]
+
+    if _scene_mesh_names is None:
+        # Callbacks can not safely remove themselves while they are being invoked, the stale ones are therefore only
+        # replaced here when walking the DAG again
+        _remove_callbacks(_visibility_callback_ids)
+        watched = set()
+        _scene_mesh_names = [dag_path.partialPathName() for dag_path, _ in _iter_scene_dagpaths(lambda dag_path: _watch_visibility(dag_path, watched))]
+        _watch_display_layers()
+    return _scene_mesh_names
+
+
+def iter_scene_meshes(chunk_size: int = 1024):
+    '''
+    Generator streaming all visible, non-intermediate meshes of the scene in chunks. The dag path, world matrix and
+    local bounding box are all captured in the same pass over the DAG into arrays preallocated to the chunk size.
+
+    :param chunk_size: the maximum amount of meshes yielded per chunk
+
+    :return: A generator yielding tuples of (dag_paths, world_matrices, local_bboxes)
+    '''
+    if chunk_size < 1:
+        om.MGlobal.displayError("iter_scene_meshes chunk_size parameter must be greater than 0")
+        return
+
+    dag_paths = [None] * chunk_size
+    world_matrices = [None] * chunk_size
+    local_bboxes = [None] * chunk_size
+    count = 0
+    for dag_path, fn_dag in _iter_scene_dagpaths():
+        dag_paths[count] = dag_path
+        world_matrices[count] = dag_path.inclusiveMatrix()
+        local_bboxes[count] = fn_dag.boundingBox
+        count = count + 1
+        if count == chunk_size:
+            yield dag_paths, world_matrices, local_bboxes
+            dag_paths = [None] * chunk_size
+            world_matrices = [None] * chunk_size
+            local_bboxes = [None] * chunk_size
+            count = 0
+
+    if count > 0:
+        yield dag_paths[:count], world_matrices[:count], local_bboxes[:count]
+
+
 class MFnMeshList():
     '''
     A wrapper around a list of meshes which speeds up mesh operations by pre-computing 
@@ -35,6 +218,48 @@ class MFnMeshList():
         _bbox = cmds.exactWorldBoundingBox(self._mesh_list)     # Use cmds in this case to avoid iterating the mesh_list to construct the bbox
         self.bbox = om.MBoundingBox(om.MPoint(_bbox[0], _bbox[1], _bbox[2]), om.MPoint(_bbox[3], _bbox[4], _bbox[5]))
 
+    @classmethod
+    @timer.timer_decorator
+    def from_scene(cls, chunk_size: int = 1024):
+        '''
+        Construct a MFnMeshList from all visible, non-intermediate meshes in the scene by streaming them through
+        iter_scene_meshes(). This avoids resolving each mesh by name and computes the world bounding boxes in the same pass
+        '''
+        instance = cls.__new__(cls)
+        instance.mfn_meshes = []
+        instance.mfn_dagpaths = []
+        instance._mesh_list = []
+        instance._bbox_cache = []
+        instance.bbox = om.MBoundingBox()
+
+        for dag_paths, world_matrices, local_bboxes in iter_scene_meshes(chunk_size):
+            instance.extend(dag_paths, world_matrices, local_bboxes)
+
+        if len(instance) == 0:
+            om.MGlobal.displayError("Unable to construct MFnMeshList without any input meshes")
+            raise RuntimeError("No meshes found in the scene")
+        return instance
+
+    def extend(self, dag_paths: list[om.MDagPath], world_matrices: list[om.MMatrix], local_bboxes: list[om.MBoundingBox]):
+        '''
+        Append a chunk of meshes as yielded by iter_scene_meshes(), the world space bounding boxes are cached right away
+        and the bbox of the whole list is expanded to fit them
+        '''
+        for dag_path, world_matrix, local_bbox in zip(dag_paths, world_matrices, local_bboxes):
+            try:
+                mfn_mesh = om.MFnMesh(dag_path)
+            except Exception:
+                om.MGlobal.displayWarning(f"Unable to construct MFnMesh instance for '{dag_path.partialPathName()}'")
+                continue
+            world_bbox = om.MBoundingBox(local_bbox)
+            world_bbox.transformUsing(world_matrix)
+
+            self.mfn_meshes.append(mfn_mesh)
+            self.mfn_dagpaths.append(dag_path)
+            self._mesh_list.append(dag_path.partialPathName())
+            self._bbox_cache.append(world_bbox)
+            self.bbox.expand(world_bbox)
+
     def get_bbox_at_index(self, index: int) -> om.MBoundingBox:
         '''
         Get the bbox at a specified index, if it already exists grab the cached result. Otherwise compute on the fly
@@ -45,12 +270,31 @@ class MFnMeshList():
         except IndexError:
             om.MGlobal.displayInfo("Tried to access illegal index at MFnMeshList.get_bbox_at_index()")
         
-        min = self.mfn_meshes[index].boundingBox.min * self.mfn_dagpaths[index].inclusiveMatrix()
-        max = self.mfn_meshes[index].boundingBox.max * self.mfn_dagpaths[index].inclusiveMatrix()
+        # Transform all corners rather than just min/max such that rotated meshes are still fully contained
+        bbox = om.MBoundingBox(self.mfn_meshes[index].boundingBox)
+        bbox.transformUsing(self.mfn_dagpaths[index].inclusiveMatrix())
 
-        self._bbox_cache[index] = om.MBoundingBox(min, max)
+        self._bbox_cache[index] = bbox
         return self._bbox_cache[index]
 
+    def invalidate_bbox(self, index: int):
+        '''
+        Drop the cached bbox at a specified index so it gets recomputed on the next access, e.g. after the mesh moved
+        '''
+        self._bbox_cache[index] = None
+
+    def is_valid(self) -> bool:
+        '''
+        Check whether all meshes still exist, e.g. they were not deleted along with the scene they were loaded from
+        '''
+        for dag_path in self.mfn_dagpaths:
+            try:
+                if not dag_path.isValid() or not om.MObjectHandle(dag_path.node()).isValid():
+                    return False
+            except RuntimeError:
+                return False
+        return True
+
     def get_name_at_index(self, index: int) -> str:
         '''
         Get the name of a mesh by its index